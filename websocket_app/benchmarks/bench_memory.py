@@ -0,0 +1,137 @@
+"""
+Memory cost of an idle WebSocket connection in the ASGI application.
+
+Opens ``--connections`` sessions in-process (no network, no uvicorn), lets them
+go idle and reports the Python heap each one holds, from tracemalloc, grouped by
+the file that allocated it. Allocations made directly by this script's client
+side are left out. A second batch, opened without tracemalloc, gives the growth
+in process RSS, which also counts the client. Run it before and after a change
+to compare.
+
+    cd websocket_app && python -m benchmarks.bench_memory --connections 5000
+"""
+import argparse
+import asyncio
+import gc
+import os
+import resource
+import tracemalloc
+
+# Keep the heartbeat and rate limiter out of the measurement
+os.environ.setdefault("HEARTBEAT_INTERVAL", "3600")
+os.environ.setdefault("RATE_LIMIT_SESSION_RATE", "0")
+os.environ.setdefault("RATE_LIMIT_IP_RATE", "0")
+os.environ.setdefault("ADMISSION_MAX_CONNECTIONS", "0")
+os.environ.setdefault("SLOW_CALLBACK_THRESHOLD", "60")  # creating thousands of connections blocks by design
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+
+class IdleClient:
+    """Just enough of an ASGI server to open a connection and leave it idle"""
+    __slots__ = ("task", "waiter", "accepted")
+
+    def __init__(self, app, index):
+        loop = asyncio.get_running_loop()
+        self.waiter = loop.create_future()
+        self.accepted = loop.create_future()
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "scheme": "ws",
+            "path": "/ws/chat/",
+            "raw_path": b"/ws/chat/",
+            "query_string": b"",
+            "headers": [
+                (b"host", b"localhost"),
+                (b"user-agent", b"bench_memory"),
+                (b"x-session-id", f"bench-{index}".encode()),
+                (b"x-real-ip", f"10.0.{index >> 8 & 255}.{index & 255}".encode()),
+            ],
+            "subprotocols": [],
+            "client": ("127.0.0.1", 40000 + index % 20000),
+            "server": ("localhost", 80),
+        }
+        self.task = asyncio.ensure_future(app(scope, self.receive, self.send))
+
+    async def receive(self):
+        if not self.accepted.done():
+            return {"type": "websocket.connect"}
+        # Idle until disconnect
+        return await self.waiter
+
+    async def send(self, message):
+        if message["type"] == "websocket.accept":
+            self.accepted.set_result(None)
+
+    async def close(self):
+        self.waiter.set_result({"type": "websocket.disconnect", "code": 1000})
+        await self.task
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+async def open_idle(app, first, count):
+    clients = [IdleClient(app, first + i) for i in range(count)]
+    await asyncio.gather(*(client.accepted for client in clients))
+    # Let connect() finish past accept() and every connection go idle
+    await asyncio.sleep(0.5)
+    gc.collect()
+    return clients
+
+
+async def measure(count, top):
+    from core.asgi import application
+
+    # Warm up imports, caches and lazily created module state
+    clients = await open_idle(application, -100, 10)
+
+    rss_before = rss_bytes()
+    clients += await open_idle(application, 0, count)
+    rss = (rss_bytes() - rss_before) / count
+
+    tracemalloc.start(1)
+    before = tracemalloc.take_snapshot()
+    clients += await open_idle(application, count, count)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    client_side = tracemalloc.Filter(False, __file__)
+    stats = after.filter_traces([client_side]).compare_to(before.filter_traces([client_side]), "filename")
+    heap = sum(stat.size_diff for stat in stats) / count
+
+    print(f"{count} idle connections")
+    print(f"  python heap:  {heap:8.0f} bytes per connection (tracemalloc, excluding the client)")
+    print(f"  process RSS:  {rss:8.0f} bytes per connection (including the client)")
+    print("  by file:")
+    for stat in sorted(stats, key=lambda stat: -stat.size_diff)[:top]:
+        name = stat.traceback[0].filename
+        for prefix in (os.getcwd() + os.sep, os.path.dirname(os.__file__) + os.sep):
+            if name.startswith(prefix):
+                name = name[len(prefix):]
+                break
+        print(f"    {stat.size_diff / count:8.0f}  {name}")
+
+    await asyncio.gather(*(client.close() for client in clients))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--connections", type=int, default=5000)
+    parser.add_argument("--top", type=int, default=12, help="allocating files to list")
+    args = parser.parse_args()
+
+    # Room for the sockets the channel layer and loop need; the client uses none
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < 4096 <= hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (4096, hard))
+
+    asyncio.run(measure(args.connections, args.top))
+
+
+if __name__ == "__main__":
+    main()
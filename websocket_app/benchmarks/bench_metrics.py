@@ -0,0 +1,48 @@
+"""
+Microbenchmark for the per-message metric recording in ChatConsumer.receive().
+
+Compares the old path (labels() lookup plus a locked prometheus_client update
+for the message counter and the processing-time histogram) against the
+buffered children behind chat.metrics.inc_messages() and
+record_message_processing_time(), including the amortized cost of flushing.
+
+    cd websocket_app && python -m benchmarks.bench_metrics
+"""
+import timeit
+
+from chat import metrics
+
+NUMBER = 200000
+
+
+def bench(label, stmt):
+    per_call = min(timeit.repeat(stmt, number=NUMBER, repeat=5)) / NUMBER
+    print(f"  {label:<36} {per_call * 1e9:8.0f} ns/op")
+    return per_call
+
+
+def old_path():
+    metrics.websocket_messages_total.labels(deployment_color=metrics.deployment_color).inc()
+    metrics.websocket_message_processing_duration.labels(deployment_color=metrics.deployment_color).observe(0.0004)
+
+
+def new_path():
+    metrics.inc_messages()
+    metrics.record_message_processing_time(0.0004)
+
+
+def main():
+    print(f"multiprocess mode: {metrics.MULTIPROCESS_MODE}")
+
+    print("per message (counter + histogram)")
+    old = bench("labels().inc() + labels().observe()", old_path)
+    new = bench("buffered inc + observe", new_path)
+    print(f"  speedup: {old / new:.1f}x")
+
+    # One flush per METRICS_FLUSH_INTERVAL, spread over the messages in between
+    per_flush = min(timeit.repeat(metrics.flush_metrics, number=1000, repeat=5)) / 1000
+    print(f"flush_metrics(): {per_flush * 1e6:.1f} us per flush")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Microbenchmark for the per-message frame encoding in ChatConsumer.
+
+Compares the old path (build a dict, stdlib json.dumps) against chat.serialization
+for the count reply, the connect frame and the heartbeat payload.
+
+    cd websocket_app && python -m benchmarks.bench_serialization
+"""
+import json
+import timeit
+from datetime import datetime, timezone
+
+from chat import serialization
+
+NUMBER = 200000
+
+
+def bench(label, stmt):
+    per_call = min(timeit.repeat(stmt, number=NUMBER, repeat=5)) / NUMBER
+    print(f"  {label:<28} {per_call * 1e9:8.0f} ns/op")
+    return per_call
+
+
+def main():
+    session_id = "5f0c6a52-1d0f-4c55-9d9e-8a3e7d1c2b4a"
+    heartbeat = {
+        "type": "heartbeat",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "active_connections": 4000,
+    }
+
+    print(f"serialization backend: {serialization.BACKEND}")
+
+    print("count reply")
+    old = bench("json.dumps(dict)", lambda: json.dumps({"count": 12345}))
+    new = bench("count_frame()", lambda: serialization.count_frame(12345))
+    print(f"  speedup: {old / new:.1f}x")
+
+    print("connect frame")
+    old = bench("json.dumps(dict)", lambda: json.dumps({"session_id": session_id, "resumed": True, "count": 12345}))
+    new = bench("connect_frame()", lambda: serialization.connect_frame(session_id, True, 12345))
+    print(f"  speedup: {old / new:.1f}x")
+
+    print("heartbeat payload")
+    old = bench("json.dumps(dict)", lambda: json.dumps(heartbeat))
+    new = bench("serialization.dumps(dict)", lambda: serialization.dumps(heartbeat))
+    print(f"  speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+"""
+Load generator and latency benchmark for ChatConsumer.
+
+Drives the real ``core.asgi.application`` either in-process (``--target inprocess``,
+the default, through a minimal ASGI client) or over the network against a running
+server (``--target ws://127.0.0.1:8000/ws/chat/``). Scenarios:
+
+- ``connect_storm``: open ``--connections`` sockets, ``--concurrency`` at a time
+- ``resume_storm``: create sessions, drop them, then reconnect all with ``X-Session-Id``
+- ``pipelined_burst``: every connection sends ``--messages`` frames without waiting,
+  then reads the replies; latency is per message, send to matching count reply
+- ``heartbeat_under_load``: idle connections record heartbeat gaps while busy ones
+  run request/reply loops for ``--duration`` seconds, which must cover three heartbeat
+  intervals; a run that records no gap is reported with ``"valid": false``
+
+The report is JSON (``--output``, default stdout) with the commit, config and per
+scenario rates and latency percentiles. ``--baseline`` prints the change against an
+earlier report.
+
+In-process runs set RATE_LIMIT_SESSION_RATE=0, RATE_LIMIT_IP_RATE=0 and
+HEARTBEAT_INTERVAL=2 unless they are already set, so the limiter does not turn the
+burst into a throttling test and the default 6s run sees several heartbeats. Against a server,
+start it with the same settings.
+
+    cd websocket_app && python -m benchmarks.loadgen --scenarios connect_storm,pipelined_burst
+    cd websocket_app && python -m benchmarks.loadgen --target ws://127.0.0.1:8000/ws/chat/ --output after.json --baseline before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import uuid
+from urllib.parse import urlencode
+
+INPROCESS_ENV = {
+    "RATE_LIMIT_SESSION_RATE": "0",
+    "RATE_LIMIT_IP_RATE": "0",
+    "HEARTBEAT_INTERVAL": "2",
+}
+
+SCENARIOS = ("connect_storm", "resume_storm", "pipelined_burst", "heartbeat_under_load")
+
+
+class InProcessClient:
+    """One WebSocket session driven straight through the ASGI application"""
+
+    def __init__(self, app, index):
+        self.app = app
+        # A distinct client address per socket, as behind a real load balancer
+        self.client = (f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}", 40000 + index % 20000)
+
+    async def connect(self, query, headers):
+        self.inbound = asyncio.Queue()
+        self.outbound = asyncio.Queue()
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "scheme": "ws",
+            "path": "/ws/chat/",
+            "raw_path": b"/ws/chat/",
+            "query_string": urlencode(query).encode(),
+            "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            "subprotocols": [],
+            "client": self.client,
+            "server": ("loadgen", 80),
+        }
+        self.task = asyncio.ensure_future(self.app(scope, self.inbound.get, self.outbound.put))
+        await self.inbound.put({"type": "websocket.connect"})
+        message = await self.outbound.get()
+        if message["type"] != "websocket.accept":
+            raise ConnectionError(f"handshake refused: {message}")
+
+    async def send(self, text):
+        await self.inbound.put({"type": "websocket.receive", "text": text})
+
+    async def recv(self):
+        message = await self.outbound.get()
+        if message["type"] == "websocket.close":
+            raise ConnectionError(f"closed with {message.get('code')}")
+        return message.get("text") or message.get("bytes")
+
+    async def close(self):
+        await self.inbound.put({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self.task, 5)
+        except Exception:
+            self.task.cancel()
+
+
+class NetworkClient:
+    """One WebSocket session against a running server"""
+
+    def __init__(self, url, index):
+        self.url = url
+
+    async def connect(self, query, headers):
+        import websockets
+
+        url = self.url + ("?" + urlencode(query) if query else "")
+        # No client pings: only the server's own heartbeats should be measured
+        self.ws = await websockets.connect(url, additional_headers=headers, ping_interval=None, max_size=None)
+
+    async def send(self, text):
+        await self.ws.send(text)
+
+    async def recv(self):
+        import websockets
+
+        try:
+            return await self.ws.recv()
+        except websockets.ConnectionClosed as e:
+            raise ConnectionError(f"closed with {e.rcvd.code if e.rcvd else None}") from None
+
+    async def close(self):
+        await self.ws.close()
+
+
+def summarize(latencies):
+    """Latency percentiles in milliseconds"""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+    n = len(ordered)
+
+    def percentile(p):
+        return round(ordered[min(n - 1, int(p * n))] * 1000, 3)
+
+    return {
+        "count": n,
+        "mean_ms": round(sum(ordered) / n * 1000, 3),
+        "p50_ms": percentile(0.50),
+        "p90_ms": percentile(0.90),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def is_heartbeat(frame):
+    return frame.startswith('{"type":"heartbeat"')
+
+
+async def recv_reply(client):
+    """Next frame that is not a heartbeat"""
+    while True:
+        frame = await client.recv()
+        if not is_heartbeat(frame):
+            return frame
+
+
+class LoadGenerator:
+    def __init__(self, make_client, args):
+        self.make_client = make_client
+        self.args = args
+        self.opened = 0
+
+    def client(self):
+        self.opened += 1
+        return self.make_client(self.opened)
+
+    async def open_many(self, count, session_ids=None):
+        """
+        Open ``count`` connections, ``--concurrency`` handshakes at a time.
+        Returns (clients, connect frames, connect latencies, failures, seconds).
+        """
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        clients, frames, latencies, failures = [], [], [], []
+
+        async def open_one(i):
+            client = self.client()
+            headers = {"X-Session-Id": session_ids[i]} if session_ids else {}
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await client.connect({}, headers)
+                    frame = await asyncio.wait_for(recv_reply(client), self.args.timeout)
+                except Exception as e:
+                    failures.append(repr(e))
+                    return
+                latencies.append(time.perf_counter() - started)
+            clients.append(client)
+            frames.append(json.loads(frame))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(open_one(i) for i in range(count)))
+        return clients, frames, latencies, failures, time.perf_counter() - started
+
+    async def close_all(self, clients):
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+    async def connect_storm(self):
+        count = self.args.connections
+        clients, _, latencies, failures, elapsed = await self.open_many(count)
+        await self.close_all(clients)
+        return {
+            "connections": count,
+            "failed": len(failures),
+            "errors": sorted(set(failures))[:5],
+            "connections_per_second": round(len(clients) / elapsed, 1),
+            "connect_latency": summarize(latencies),
+        }
+
+    async def resume_storm(self):
+        count = self.args.connections
+        session_ids = [f"loadgen-{uuid.uuid4()}" for _ in range(count)]
+
+        # Give every session some state, then drop all sockets at once
+        clients, _, _, failures, _ = await self.open_many(count, session_ids)
+        for client in clients:
+            await client.send("{}")
+        for client in clients:
+            await asyncio.wait_for(recv_reply(client), self.args.timeout)
+        await self.close_all(clients)
+
+        clients, frames, latencies, resume_failures, elapsed = await self.open_many(count, session_ids)
+        await self.close_all(clients)
+        return {
+            "connections": count,
+            "failed": len(failures) + len(resume_failures),
+            "errors": sorted(set(failures + resume_failures))[:5],
+            "resumed": sum(1 for frame in frames if frame.get("resumed")),
+            "connections_per_second": round(len(clients) / elapsed, 1),
+            "connect_latency": summarize(latencies),
+        }
+
+    async def pipelined_burst(self):
+        count = self.args.connections
+        per_connection = self.args.messages
+        clients, _, _, failures, _ = await self.open_many(count)
+        latencies = []
+        errors = []
+
+        async def burst(client):
+            sent_at = []
+            for _ in range(per_connection):
+                sent_at.append(time.perf_counter())
+                await client.send("{}")
+            # Replies carry the session's running count, so reply n answers message n
+            for i in range(per_connection):
+                try:
+                    await asyncio.wait_for(recv_reply(client), self.args.timeout)
+                except Exception as e:
+                    errors.append(repr(e))
+                    return
+                latencies.append(time.perf_counter() - sent_at[i])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(burst(client) for client in clients))
+        elapsed = time.perf_counter() - started
+        await self.close_all(clients)
+        return {
+            "connections": count,
+            "messages_per_connection": per_connection,
+            "failed": len(failures) + len(errors),
+            "errors": sorted(set(failures + errors))[:5],
+            "messages_per_second": round(len(latencies) / elapsed, 1),
+            "message_latency": summarize(latencies),
+        }
+
+    async def heartbeat_under_load(self):
+        busy_count = max(1, self.args.connections // 10)
+        idle_count = max(1, self.args.connections - busy_count)
+        duration = self.args.duration
+        idle, _, _, idle_failures, _ = await self.open_many(idle_count)
+        busy, _, _, busy_failures, _ = await self.open_many(busy_count)
+
+        deadline = time.perf_counter() + duration
+        gaps = []
+        heartbeats = 0
+        latencies = []
+
+        async def listen(client):
+            nonlocal heartbeats
+            last = None
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return
+                try:
+                    frame = await asyncio.wait_for(client.recv(), remaining)
+                except (asyncio.TimeoutError, ConnectionError):
+                    return
+                if is_heartbeat(frame):
+                    now = time.perf_counter()
+                    heartbeats += 1
+                    if last is not None:
+                        gaps.append(now - last)
+                    last = now
+
+        async def work(client):
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                await client.send("{}")
+                await asyncio.wait_for(recv_reply(client), self.args.timeout)
+                latencies.append(time.perf_counter() - started)
+
+        results = await asyncio.gather(
+            *(listen(client) for client in idle), *(work(client) for client in busy),
+            return_exceptions=True
+        )
+        errors = [repr(result) for result in results if isinstance(result, Exception)]
+        await self.close_all(idle + busy)
+        if not gaps:
+            # Nothing to report: no idle connection saw two heartbeats
+            print("heartbeat_under_load recorded no heartbeat gap; run it for at least "
+                  "three heartbeat intervals", file=sys.stderr)
+        return {
+            "valid": bool(gaps),
+            "idle_connections": idle_count,
+            "busy_connections": busy_count,
+            "duration_seconds": duration,
+            "failed": len(idle_failures) + len(busy_failures) + len(errors),
+            "errors": sorted(set(idle_failures + busy_failures + errors))[:5],
+            "heartbeats_received": heartbeats,
+            "heartbeat_gap": summarize(gaps),
+            "messages_per_second": round(len(latencies) / duration, 1),
+            "message_latency": summarize(latencies),
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_application():
+    """Import core.asgi inside the running loop, so its background tasks start on it"""
+    for name, value in INPROCESS_ENV.items():
+        os.environ.setdefault(name, value)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+    from core.asgi import application
+    return application
+
+
+# Measured results compared against a baseline; latencies (*_ms) and failures are lower-is-better
+HIGHER_IS_BETTER = ("connections_per_second", "messages_per_second", "resumed", "heartbeats_received")
+LOWER_IS_BETTER = ("failed",)
+
+
+def compare(report, baseline):
+    """Print the change of every measured result against an earlier report"""
+    print(f"baseline {baseline.get('commit')} -> {report.get('commit')}", file=sys.stderr)
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        print(name, file=sys.stderr)
+        for key, value, old in _numeric_pairs(result, before):
+            higher_is_better = key in HIGHER_IS_BETTER
+            if not old or not (higher_is_better or key in LOWER_IS_BETTER or key.endswith("_ms")):
+                continue
+            change = (value - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            marker = "+" if better else "-" if change else " "
+            print(f"  {marker} {key:<32} {old:>12} -> {value:<12} ({change:+.1f}%)", file=sys.stderr)
+
+
+def _numeric_pairs(result, before, prefix=""):
+    for key, value in result.items():
+        old = before.get(key)
+        if isinstance(value, dict) and isinstance(old, dict):
+            yield from _numeric_pairs(value, old, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)):
+            yield f"{prefix}{key}", value, old
+
+
+async def run(args):
+    if args.target == "inprocess":
+        application = load_application()
+
+        def make_client(index):
+            return InProcessClient(application, index)
+    else:
+        def make_client(index):
+            return NetworkClient(args.target, index)
+
+    generator = LoadGenerator(make_client, args)
+    report = {
+        "commit": git_commit(),
+        "target": args.target,
+        "python": platform.python_version(),
+        "started_at": int(time.time()),
+        "config": {
+            "connections": args.connections,
+            "concurrency": args.concurrency,
+            "messages": args.messages,
+            "duration": args.duration,
+            **({name: os.environ[name] for name in INPROCESS_ENV} if args.target == "inprocess" else {}),
+        },
+        "scenarios": {},
+    }
+    for name in args.scenarios:
+        print(f"running {name}", file=sys.stderr)
+        report["scenarios"][name] = await getattr(generator, name)()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--target", default="inprocess", help="'inprocess' or a ws:// URL of the chat endpoint")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), type=lambda value: value.split(","))
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100, help="handshakes in flight at once")
+    parser.add_argument("--messages", type=int, default=50, help="messages per connection in pipelined_burst")
+    parser.add_argument("--duration", type=float, default=6,
+                        help="seconds of heartbeat_under_load, at least three heartbeat intervals")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds to wait for any one reply")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if "heartbeat_under_load" in args.scenarios and args.target == "inprocess":
+        # A gap needs two heartbeats. New connections only count as idle after a
+        # whole interval, and their wheel bucket may take another one to come round.
+        interval = float(os.environ.get("HEARTBEAT_INTERVAL", INPROCESS_ENV["HEARTBEAT_INTERVAL"]))
+        if args.duration < 3 * interval:
+            parser.error(f"--duration must be at least {3 * interval:g}s (three heartbeat intervals) "
+                         "for heartbeat_under_load")
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Admission control for new WebSocket connections.
+
+A worker stops taking new handshakes while it is over any configured limit
+(connections, event-loop lag, recent message latency) or draining for
+shutdown. ``/ready/`` reports the same state as 503, so nginx and
+orchestrators move traffic away before latency collapses. Existing
+connections are never affected.
+"""
+import asyncio
+import os
+import time
+from chat import loop_monitor
+from chat.connection_pool import registry
+from chat.metrics import inc_connections_rejected
+
+# Limits per worker process; 0 disables a check
+ADMISSION_MAX_CONNECTIONS = int(os.getenv('ADMISSION_MAX_CONNECTIONS', '4000'))
+ADMISSION_MAX_LOOP_LAG = float(os.getenv('ADMISSION_MAX_LOOP_LAG', '0.5'))  # seconds
+ADMISSION_MAX_MESSAGE_LATENCY = float(os.getenv('ADMISSION_MAX_MESSAGE_LATENCY', '0.5'))  # seconds, smoothed
+ADMISSION_POLICY = os.getenv('ADMISSION_POLICY', 'reject')  # reject, or defer: hold the handshake
+ADMISSION_DEFER_TIMEOUT = float(os.getenv('ADMISSION_DEFER_TIMEOUT', '5'))  # seconds before a deferred handshake is rejected
+
+# "Try Again Later"
+OVERLOADED_CLOSE_CODE = 1013
+
+LATENCY_EWMA_ALPHA = 0.1
+# Without new messages the latency average is stale; stop acting on it
+LATENCY_STALE_AFTER = 5
+
+DEFER_POLL_INTERVAL = 0.1
+
+# Set once shutdown starts; new connections are refused from then on
+draining = False
+
+_message_latency = 0.0
+_message_latency_at = 0.0
+
+
+def observe_message_latency(seconds):
+    """Fold one message's processing time into the moving average"""
+    global _message_latency, _message_latency_at
+    _message_latency += LATENCY_EWMA_ALPHA * (seconds - _message_latency)
+    _message_latency_at = time.monotonic()
+
+
+def message_latency():
+    """Recent average message processing time, 0 once it is stale"""
+    if time.monotonic() - _message_latency_at > LATENCY_STALE_AFTER:
+        return 0.0
+    return _message_latency
+
+
+def overload_reason():
+    """Why this worker is not taking connections right now, or None"""
+    if draining:
+        return "draining"
+    if ADMISSION_MAX_CONNECTIONS and len(registry) >= ADMISSION_MAX_CONNECTIONS:
+        return "connections"
+    if ADMISSION_MAX_LOOP_LAG and loop_monitor.loop_lag >= ADMISSION_MAX_LOOP_LAG:
+        return "loop_lag"
+    if ADMISSION_MAX_MESSAGE_LATENCY and message_latency() >= ADMISSION_MAX_MESSAGE_LATENCY:
+        return "message_latency"
+    return None
+
+
+async def admit():
+    """
+    Decide on a new handshake: None to let it through, else the reason it is
+    refused. With ADMISSION_POLICY=defer the handshake waits up to
+    ADMISSION_DEFER_TIMEOUT for the worker to recover (never while draining).
+    """
+    reason = overload_reason()
+    if reason is None or reason == "draining" or ADMISSION_POLICY != "defer":
+        return reason
+
+    deadline = time.monotonic() + ADMISSION_DEFER_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(DEFER_POLL_INTERVAL)
+        reason = overload_reason()
+        if reason is None or reason == "draining":
+            return reason
+    return reason
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that turns away WebSocket handshakes while overloaded"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            reason = await admit()
+            if reason is not None:
+                inc_connections_rejected(reason)
+                await receive()  # websocket.connect
+                # uvicorn can only refuse a handshake with a bare 403; accepting
+                # first lets clients see 1013 and back off before retrying
+                await send({"type": "websocket.accept"})
+                await send({"type": "websocket.close", "code": OVERLOADED_CLOSE_CODE})
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,25 @@
+import os
+from channels.layers import get_channel_layer
+from chat.codecs import encode_for_all
+
+# Every ChatConsumer joins this group on connect
+BROADCAST_GROUP = "broadcast"
+
+# Let any client relay {"broadcast": ...} to everyone; server code can always broadcast
+CLIENT_BROADCAST = os.getenv('CLIENT_BROADCAST', 'off') == 'on'
+
+
+async def broadcast(payload):
+    """
+    Push ``payload`` to every connected client on every process sharing the channel layer.
+
+    The frame is encoded here, once per wire codec; the channel layer then fans the
+    same frames out per process and each consumer only forwards the one it speaks.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        raise RuntimeError("CHANNEL_LAYERS is not configured")
+    await channel_layer.group_send(BROADCAST_GROUP, {
+        "type": "chat.broadcast",
+        "frames": encode_for_all(payload),
+    })
@@ -0,0 +1,310 @@
+import asyncio
+import atexit
+import base64
+import json
+import logging
+import os
+import random
+import socket
+import string
+import time
+import uuid
+from collections import deque
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_default(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"{type(value).__name__} is not serializable by the channel layer")
+
+
+def _decode_hook(obj):
+    if len(obj) == 1 and "__bytes__" in obj:
+        return base64.b64decode(obj["__bytes__"])
+    return obj
+
+
+class Mailbox:
+    """
+    Messages waiting on one local channel and the receiver waiting for them.
+
+    A lighter stand-in for asyncio.Queue, which allocates three deques per
+    channel: every idle connection keeps one mailbox with a pending receive, so
+    the message deque is only allocated while messages are waiting. Channels have
+    a single receiver, so a single waiter future is enough.
+    """
+    __slots__ = ("messages", "waiter")
+
+    def __init__(self):
+        self.messages = None  # deque of (expires_at, message)
+        self.waiter = None
+
+    def __len__(self):
+        return len(self.messages) if self.messages else 0
+
+    def put(self, item):
+        if self.messages is None:
+            self.messages = deque()
+        self.messages.append(item)
+        self.wake()
+
+    def wake(self):
+        """Resume the waiting receiver, if any"""
+        waiter = self.waiter
+        if waiter is not None:
+            self.waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def get(self):
+        """The next message, or None when woken by ``wake()`` with nothing queued"""
+        if not self.messages:
+            if self.waiter is None:
+                self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            except asyncio.CancelledError:
+                self.waiter = None
+                raise
+            if not self.messages:
+                return None
+        item = self.messages.popleft()
+        if not self.messages:
+            self.messages = None
+        return item
+
+
+class MessageTooLarge(ChannelFull):
+    """The encoded message does not fit in one datagram, so no peer process could receive it"""
+
+
+class LocalProcessChannelLayer(BaseChannelLayer):
+    """
+    Channel layer shared by every process on the host through Unix datagram sockets.
+
+    Each process binds one socket in ``socket_dir`` and keeps its own group
+    membership. ``group_send`` encodes the message once and sends one datagram per
+    peer process; each process then hands the same decoded message to all of its
+    local members, so a broadcast is never serialized per socket. No broker is
+    needed: uvicorn workers and both blue/green colors only have to share
+    ``socket_dir``.
+
+    Messages are delivered at most once; a peer whose receive buffer is full drops
+    the datagram rather than stalling the sender. A message for peer processes
+    that encodes to more than ``MAX_DATAGRAM_SIZE`` bytes raises MessageTooLarge
+    before anyone, local members included, gets it. Non process-specific
+    channels (names without ``!``) are only delivered within the sending process.
+    """
+
+    extensions = ["groups", "flush"]
+
+    PEER_REFRESH_INTERVAL = 1.0
+    RECV_BUFFER_SIZE = 4 * 1024 * 1024
+    MAX_DATAGRAM_SIZE = 256 * 1024
+
+    def __init__(self, socket_dir="/tmp/ws-channel-layer", expiry=60, capacity=100,
+                 channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.socket_dir = socket_dir
+        self.process_token = uuid.uuid4().hex[:12]
+        self.socket_path = os.path.join(socket_dir, f"{self.process_token}.sock")
+
+        self._channels = {}  # channel -> Mailbox
+        self._groups = {}  # group -> set of local channels
+        self._sock = None
+        self._loop = None
+        self._peers = []
+        self._peers_refreshed_at = 0.0
+
+    # Socket plumbing
+
+    def _ensure_started(self):
+        if self._sock is not None:
+            return
+        os.makedirs(self.socket_dir, exist_ok=True)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RECV_BUFFER_SIZE)
+            # The send buffer caps the datagram size; make room for the largest we allow
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.MAX_DATAGRAM_SIZE)
+        except OSError:
+            pass
+        sock.bind(self.socket_path)
+        self._sock = sock
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(sock.fileno(), self._on_readable)
+        atexit.register(self._unlink)
+        logger.info("Channel layer socket bound", extra={"socket_path": self.socket_path})
+
+    def _unlink(self):
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+    def _peer_paths(self):
+        now = time.monotonic()
+        if now - self._peers_refreshed_at >= self.PEER_REFRESH_INTERVAL:
+            self._peers = [
+                entry.path for entry in os.scandir(self.socket_dir)
+                if entry.name.endswith(".sock") and entry.path != self.socket_path
+            ]
+            self._peers_refreshed_at = now
+        return self._peers
+
+    def _send_datagram(self, path, payload):
+        try:
+            self._sock.sendto(payload, path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Nobody is bound to it any more: a worker or container that exited
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            self._peers_refreshed_at = 0.0
+        except BlockingIOError:
+            logger.warning("Channel layer peer is full, dropping message", extra={"peer": path})
+        except OSError as e:
+            logger.error("Channel layer send failed", extra={"peer": path, "error": str(e)})
+
+    def _on_readable(self):
+        while True:
+            try:
+                payload = self._sock.recv(self.MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.error("Channel layer receive failed", extra={"error": str(e)})
+                return
+            try:
+                envelope = json.loads(payload, object_hook=_decode_hook)
+            except ValueError:
+                logger.warning("Channel layer dropped malformed datagram")
+                continue
+            if "group" in envelope:
+                self._deliver_group(envelope["group"], envelope["message"])
+            else:
+                self._deliver(envelope["channel"], envelope["message"])
+
+    def _encode(self, envelope, name):
+        payload = json.dumps(envelope, separators=(",", ":"), default=_encode_default).encode()
+        if len(payload) > self.MAX_DATAGRAM_SIZE:
+            raise MessageTooLarge(f"{name}: {len(payload)} bytes encoded, at most {self.MAX_DATAGRAM_SIZE} fit in a datagram")
+        return payload
+
+    # Local delivery
+
+    def _is_local(self, channel):
+        if "!" not in channel:
+            return True
+        return channel[:channel.index("!")].rsplit(".", 1)[-1] == self.process_token
+
+    def _deliver(self, channel, message):
+        mailbox = self._channels.get(channel)
+        if mailbox is None:
+            # Nobody is receiving on it (any more)
+            return False
+        if len(mailbox) >= self.get_capacity(channel):
+            return False
+        mailbox.put((time.monotonic() + self.expiry, message))
+        return True
+
+    def _deliver_group(self, group, message):
+        # Members share the same message dict; handlers must not mutate it
+        for channel in self._groups.get(group, ()):
+            self._deliver(channel, message)
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self._ensure_started()
+
+        if self._is_local(channel):
+            if channel not in self._channels:
+                self._channels[channel] = Mailbox()
+            if not self._deliver(channel, message):
+                raise ChannelFull(channel)
+            return
+
+        token = channel[:channel.index("!")].rsplit(".", 1)[-1]
+        payload = self._encode({"channel": channel, "message": message}, channel)
+        self._send_datagram(os.path.join(self.socket_dir, f"{token}.sock"), payload)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        self._ensure_started()
+        while True:
+            # Looked up again after every wake-up: flush() replaces the mailboxes
+            mailbox = self._channels.get(channel)
+            if mailbox is None:
+                mailbox = self._channels[channel] = Mailbox()
+            try:
+                item = await mailbox.get()
+            except asyncio.CancelledError:
+                # The consumer is gone; stop queueing messages for it
+                if not mailbox and self._channels.get(channel) is mailbox:
+                    del self._channels[channel]
+                raise
+            if item is not None:
+                expires_at, message = item
+                if expires_at >= time.monotonic():
+                    return message
+
+    async def new_channel(self, prefix="specific"):
+        self._ensure_started()
+        suffix = "".join(random.choice(string.ascii_letters) for _ in range(12))
+        return f"{prefix}.{self.process_token}!{suffix}"
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        self._ensure_started()
+        self._groups.setdefault(group, set()).add(channel)
+        if channel not in self._channels:
+            self._channels[channel] = Mailbox()
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+        members = self._groups.get(group)
+        if members is not None:
+            members.discard(channel)
+            if not members:
+                del self._groups[group]
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        self._ensure_started()
+
+        # Encoded before local delivery, so a message too large for the peers reaches nobody
+        peers = self._peer_paths()
+        payload = self._encode({"group": group, "message": message}, group) if peers else None
+        self._deliver_group(group, message)
+        for path in peers:
+            self._send_datagram(path, payload)
+
+    async def flush(self):
+        channels = self._channels
+        self._channels = {}
+        self._groups = {}
+        # Pending receive() calls move over to fresh, empty mailboxes
+        for mailbox in channels.values():
+            mailbox.wake()
+
+    async def close(self):
+        if self._sock is None:
+            return
+        self._loop.remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        self._unlink()
@@ -0,0 +1,185 @@
+"""
+Wire codecs negotiated per connection through ``Sec-WebSocket-Protocol``.
+
+A client lists the subprotocols it accepts (e.g. ``new WebSocket(url, ["msgpack", "json"])``)
+and the first one the server supports is used for the whole session: replies,
+broadcasts, heartbeats and the shutdown "bye" frame. Clients that offer nothing
+get JSON text frames, as before.
+"""
+from chat import serialization
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+class JSONCodec:
+    name = "json"
+    binary = False
+
+    encode = staticmethod(serialization.dumps)
+    decode = staticmethod(serialization.loads)
+    count_frame = staticmethod(serialization.count_frame)
+    bye_frame = staticmethod(serialization.bye_frame)
+    connect_frame = staticmethod(serialization.connect_frame)
+
+    @staticmethod
+    def join_frames(frames):
+        """Array-frame already-encoded frames without decoding them"""
+        return "[" + ",".join(frames) + "]"
+
+    @staticmethod
+    def add_seq(frame, seq):
+        """Splice a "seq" key into an encoded object frame; other frames are returned as-is"""
+        if not frame.startswith("{"):
+            return frame
+        if frame.startswith("{}"):
+            return '{"seq":%d}' % seq
+        return '{"seq":%d,' % seq + frame[1:]
+
+
+class MsgPackCodec:
+    name = "msgpack"
+    binary = True
+
+    # Pre-encoded map headers and keys for the fixed-shape frames
+    _COUNT_PREFIX = b"\x81\xa5count"
+    _BYE_PREFIX = b"\x82\xa3bye\xc3\xa5total"
+    _SEQ_KEY = b"\xa3seq"
+
+    def __init__(self):
+        self._packer = msgpack.Packer()
+        self.encode = self._packer.pack
+
+    @staticmethod
+    def decode(data):
+        return msgpack.unpackb(data, raw=False)
+
+    def count_frame(self, count):
+        return self._COUNT_PREFIX + self._packer.pack(count)
+
+    def bye_frame(self, total):
+        return self._BYE_PREFIX + self._packer.pack(total)
+
+    def connect_frame(self, session_id, resumed, count):
+        return self._packer.pack({"session_id": session_id, "resumed": resumed, "count": count})
+
+    @staticmethod
+    def join_frames(frames):
+        n = len(frames)
+        if n < 16:
+            header = bytes((0x90 | n,))
+        elif n < 0x10000:
+            header = b"\xdc" + n.to_bytes(2, "big")
+        else:
+            header = b"\xdd" + n.to_bytes(4, "big")
+        return header + b"".join(frames)
+
+    def add_seq(self, frame, seq):
+        """Splice a "seq" key into an encoded map frame; other frames are returned as-is"""
+        first = frame[0]
+        if 0x80 <= first <= 0x8f:
+            n, body = first - 0x80, frame[1:]
+        elif first == 0xde:
+            n, body = int.from_bytes(frame[1:3], "big"), frame[3:]
+        elif first == 0xdf:
+            n, body = int.from_bytes(frame[1:5], "big"), frame[5:]
+        else:
+            return frame
+        n += 1
+        if n < 16:
+            header = bytes((0x80 | n,))
+        elif n < 0x10000:
+            header = b"\xde" + n.to_bytes(2, "big")
+        else:
+            header = b"\xdf" + n.to_bytes(4, "big")
+        return header + self._SEQ_KEY + self._packer.pack(seq) + body
+
+
+class CBORCodec:
+    name = "cbor"
+    binary = True
+
+    encode = staticmethod(cbor2.dumps if cbor2 else None)
+    decode = staticmethod(cbor2.loads if cbor2 else None)
+
+    def count_frame(self, count):
+        return self.encode({"count": count})
+
+    def bye_frame(self, total):
+        return self.encode({"bye": True, "total": total})
+
+    def connect_frame(self, session_id, resumed, count):
+        return self.encode({"session_id": session_id, "resumed": resumed, "count": count})
+
+    @staticmethod
+    def join_frames(frames):
+        n = len(frames)
+        if n < 24:
+            header = bytes((0x80 | n,))
+        elif n < 0x100:
+            header = b"\x98" + bytes((n,))
+        elif n < 0x10000:
+            header = b"\x99" + n.to_bytes(2, "big")
+        else:
+            header = b"\x9a" + n.to_bytes(4, "big")
+        return header + b"".join(frames)
+
+    def add_seq(self, frame, seq):
+        """Splice a "seq" key into an encoded map frame; other frames are returned as-is"""
+        first = frame[0]
+        if 0xa0 <= first <= 0xb7:
+            n, body = first - 0xa0, frame[1:]
+        elif first == 0xb8:
+            n, body = frame[1], frame[2:]
+        elif first == 0xb9:
+            n, body = int.from_bytes(frame[1:3], "big"), frame[3:]
+        elif first == 0xba:
+            n, body = int.from_bytes(frame[1:5], "big"), frame[5:]
+        else:
+            return frame
+        n += 1
+        if n < 24:
+            header = bytes((0xa0 | n,))
+        elif n < 0x100:
+            header = b"\xb8" + bytes((n,))
+        elif n < 0x10000:
+            header = b"\xb9" + n.to_bytes(2, "big")
+        else:
+            header = b"\xba" + n.to_bytes(4, "big")
+        return header + b"\x63seq" + self.encode(seq) + body
+
+
+JSON_CODEC = JSONCodec()
+
+# Supported codecs by subprotocol name; binary codecs only when their library is installed
+CODECS = {JSON_CODEC.name: JSON_CODEC}
+if msgpack is not None:
+    CODECS[MsgPackCodec.name] = MsgPackCodec()
+if cbor2 is not None:
+    CODECS[CBORCodec.name] = CBORCodec()
+
+
+def negotiate(subprotocols):
+    """
+    Pick the codec for a handshake from the client's offered subprotocols.
+
+    Returns ``(codec, subprotocol)``; ``subprotocol`` is what to pass to
+    ``accept()`` and is None when the client offered nothing we support.
+    """
+    for subprotocol in subprotocols or ():
+        codec = CODECS.get(subprotocol)
+        if codec is not None:
+            return codec, subprotocol
+    return JSON_CODEC, None
+
+
+def encode_for_all(payload):
+    """Encode a payload once per supported codec, keyed by codec name"""
+    return {name: codec.encode(payload) for name, codec in CODECS.items()}
@@ -1,52 +1,271 @@
 import asyncio
-import json
+import itertools
+import logging
+import os
+import random
+import time
+import zlib
 from datetime import datetime, timezone
-from chat.metrics import inc_heartbeat_pings, set_active_connections
+from chat.codecs import JSON_CODEC
+from chat.registry import ConnectionRegistry
+from chat.metrics import (
+    inc_heartbeat_pings, set_active_connections, inc_heartbeat_pong_timeouts,
+    record_heartbeat_cycle_duration, record_heartbeat_send_duration, record_heartbeat_rtt
+)
 
-active_connections = set()
+logger = logging.getLogger(__name__)
 
-async def heartbeat():
-    """Send heartbeat to all active connections every 30 seconds"""
-    while True:
-        await asyncio.sleep(30)
-        timestamp = datetime.now(timezone.utc).isoformat()
-        message = json.dumps({
-            "type": "heartbeat",
-            "timestamp": timestamp,
-            "active_connections": len(active_connections)
-        })
-        
-        stale_connections = []
-        successful_pings = 0
+# This worker's live connections, indexed by session, client IP and connect time
+registry = ConnectionRegistry()
+
+# Heartbeat tuning (seconds unless noted)
+HEARTBEAT_INTERVAL = float(os.getenv('HEARTBEAT_INTERVAL', '30'))
+HEARTBEAT_BUCKETS = max(1, int(os.getenv('HEARTBEAT_BUCKETS', '30')))  # time-wheel slots per interval
+HEARTBEAT_CONCURRENCY = max(1, int(os.getenv('HEARTBEAT_CONCURRENCY', '256')))  # max in-flight sends
+HEARTBEAT_SEND_TIMEOUT = float(os.getenv('HEARTBEAT_SEND_TIMEOUT', '5'))
+HEARTBEAT_MAX_MISSED_PONGS = int(os.getenv('HEARTBEAT_MAX_MISSED_PONGS', '3'))  # ?pong=1 clients; 0 never evicts
+
+# Time wheel: each connection lives in one bucket, chosen by a stable hash of its
+# session id. One bucket is pinged per tick, so a full turn takes HEARTBEAT_INTERVAL.
+heartbeat_wheel = [set() for _ in range(HEARTBEAT_BUCKETS)]
+
+# Every tick's heartbeat carries a new id; ?pong=1 clients echo it back as {"pong": id}
+_heartbeat_ids = itertools.count(1)
+
+
+class HeartbeatProbe:
+    """
+    Ping/pong state of one ?pong=1 connection.
+
+    ``rtt`` is smoothed like TCP's SRTT (1/8 of each new sample), so one slow
+    pong does not swing it.
+    """
+    __slots__ = ("heartbeat_id", "sent_at", "missed", "rtt")
+
+    def __init__(self):
+        self.heartbeat_id = None  # unanswered heartbeat, if any
+        self.sent_at = 0.0
+        self.missed = 0
+        self.rtt = None
+
+    def ping(self, heartbeat_id, last_seen):
+        """
+        A heartbeat is about to go out. Counts the previous one as missed when
+        the client has sent nothing at all since it; returns the missed count.
+        """
+        if self.heartbeat_id is not None and last_seen < self.sent_at:
+            self.missed += 1
+        else:
+            self.missed = 0
+        self.heartbeat_id = heartbeat_id
+        self.sent_at = time.monotonic()
+        return self.missed
+
+    def pong(self, heartbeat_id):
+        """The client echoed ``heartbeat_id``; returns the round trip, or None for a stale id"""
+        if heartbeat_id != self.heartbeat_id:
+            return None
+        rtt = time.monotonic() - self.sent_at
+        self.heartbeat_id = None
+        self.missed = 0
+        self.rtt = rtt if self.rtt is None else self.rtt + (rtt - self.rtt) / 8
+        return rtt
+
+
+def record_pong(conn, heartbeat_id):
+    """Handle a {"pong": id} frame from ``conn``"""
+    probe = getattr(conn, 'probe', None)
+    if probe is None:
+        return
+    rtt = probe.pong(heartbeat_id)
+    if rtt is not None:
+        record_heartbeat_rtt(rtt)
+
+
+def _bucket_index(conn):
+    session_id = getattr(conn, 'session_id', None) or str(id(conn))
+    return zlib.crc32(session_id.encode()) % HEARTBEAT_BUCKETS
+
+
+def register_connection(conn):
+    """Track a newly accepted connection"""
+    registry.add(conn)
+    heartbeat_wheel[_bucket_index(conn)].add(conn)
+
+
+def unregister_connection(conn):
+    """Stop tracking a connection; safe to call more than once"""
+    registry.discard(conn)
+    heartbeat_wheel[_bucket_index(conn)].discard(conn)
+
+
+async def _close_stale(conn):
+    """Best-effort close of an evicted connection, never blocking the caller for long"""
+    try:
+        # No drain: it could outlast the timeout and cancel the close with it
+        await asyncio.wait_for(conn.abort(1011), HEARTBEAT_SEND_TIMEOUT)
+    except Exception:
+        pass
+
+
+async def _send_heartbeat(conn, frame):
+    await conn.send_frame(frame, sequenced=False)
+    await conn.wait_sent()
 
-        for conn in active_connections:
+
+async def send_heartbeats(connections, payload):
+    """
+    Fan a heartbeat out to ``connections`` concurrently.
+
+    The payload is encoded once per wire codec in use, not once per connection.
+
+    At most HEARTBEAT_CONCURRENCY sends are in flight at once and each send is
+    bounded by HEARTBEAT_SEND_TIMEOUT, so one slow client cannot hold up the rest.
+    A send only counts once the frame has been written out, not just queued, so
+    a client whose socket stopped draining times out here. Returns the list of
+    connections whose send failed or timed out.
+    """
+    stale_connections = []
+    frames = {}
+    pending = iter(connections)
+
+    async def worker():
+        # Workers share one iterator, so each connection is pinged exactly once
+        for conn in pending:
+            codec = getattr(conn, 'codec', JSON_CODEC)
+            frame = frames.get(codec.name)
+            if frame is None:
+                frame = frames[codec.name] = codec.encode(payload)
+            start = time.perf_counter()
             try:
-                await conn.send(text_data=message)
-                successful_pings += 1
+                await asyncio.wait_for(_send_heartbeat(conn, frame), HEARTBEAT_SEND_TIMEOUT)
                 inc_heartbeat_pings()
             except Exception as e:
-                print(f"Heartbeat failed for connection {getattr(conn, 'session_id', 'unknown')}: {e}")
+                logger.warning("Heartbeat failed", extra={
+                    "session_id": getattr(conn, 'session_id', 'unknown'),
+                    "error": repr(e)
+                })
                 stale_connections.append(conn)
+            finally:
+                record_heartbeat_send_duration(time.perf_counter() - start)
+
+    workers = min(HEARTBEAT_CONCURRENCY, len(connections))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return stale_connections
+
+
+async def heartbeat_tick(bucket):
+    """Ping the idle connections of one wheel bucket and evict the ones that failed"""
+    start = time.perf_counter()
+
+    # Any message received within the interval already proves the client is alive.
+    # ?pong=1 connections are pinged every turn regardless: their echoes count as
+    # messages, so skipping them would halve the RTT samples and the miss count.
+    idle_since = time.monotonic() - HEARTBEAT_INTERVAL
+    connections = [
+        conn for conn in heartbeat_wheel[bucket]
+        if getattr(conn, 'probe', None) is not None or getattr(conn, 'last_seen', 0) <= idle_since
+    ]
+    if not connections:
+        return
+
+    heartbeat_id = next(_heartbeat_ids)
+    timestamp = datetime.now(timezone.utc).isoformat()
+    payload = {
+        "type": "heartbeat",
+        "id": heartbeat_id,
+        "timestamp": timestamp,
+        "active_connections": len(registry)
+    }
+
+    # ?pong=1 clients silent since their last HEARTBEAT_MAX_MISSED_PONGS heartbeats
+    # are half-open or hung; evict them instead of pinging again
+    unresponsive = set()
+    for conn in connections:
+        probe = getattr(conn, 'probe', None)
+        if probe is not None and probe.ping(heartbeat_id, conn.last_seen) >= HEARTBEAT_MAX_MISSED_PONGS > 0:
+            unresponsive.add(conn)
+    if unresponsive:
+        inc_heartbeat_pong_timeouts(len(unresponsive))
+        connections = [conn for conn in connections if conn not in unresponsive]
+
+    stale_connections = await send_heartbeats(connections, payload)
+    stale_connections.extend(unresponsive)
+
+    # Remove stale connections
+    for conn in stale_connections:
+        unregister_connection(conn)
+        asyncio.ensure_future(_close_stale(conn))
+
+    # Update active connections metric
+    set_active_connections(len(registry))
+    record_heartbeat_cycle_duration(time.perf_counter() - start)
+
+    if stale_connections:
+        logger.info("Heartbeat evicted stale connections", extra={
+            "bucket": bucket,
+            "sent": len(connections) - len(stale_connections) + len(unresponsive),
+            "stale": len(stale_connections),
+            "missed_pongs": len(unresponsive)
+        })
+
+
+async def heartbeat():
+    """
+    Drive the heartbeat time wheel.
+
+    Every HEARTBEAT_INTERVAL / HEARTBEAT_BUCKETS seconds one bucket is pinged, so
+    each connection is still checked once per interval while the per-tick load
+    stays flat. The starting phase is randomized so blue and green nodes do not
+    tick in lockstep.
+    """
+    loop = asyncio.get_running_loop()
+    tick_interval = HEARTBEAT_INTERVAL / HEARTBEAT_BUCKETS
+    bucket = random.randrange(HEARTBEAT_BUCKETS)
+    next_run = loop.time() + random.uniform(0, tick_interval)
+    while True:
+        await asyncio.sleep(max(0.0, next_run - loop.time()))
+        try:
+            await heartbeat_tick(bucket)
+        except Exception as e:
+            logger.exception("Heartbeat tick failed")
+
+        # Fixed-rate schedule: a long tick skips missed slots instead of drifting
+        skipped = 1
+        next_run += tick_interval
+        now = loop.time()
+        if next_run <= now:
+            behind = int((now - next_run) // tick_interval) + 1
+            next_run += behind * tick_interval
+            skipped += behind
+        bucket = (bucket + skipped) % HEARTBEAT_BUCKETS
+
+def get_connection_stats(after=0, limit=100):
+    """
+    One page of this worker's connections, in connect order, plus O(1) counts.
+    Pass the returned ``next`` as ``after`` for the following page.
+    """
+    connections, next_cursor = registry.page(after, limit)
+    now = time.monotonic()
+    return {
+        "counts": registry.counts(),
+        "connections": [describe_connection(conn, now) for conn in connections],
+        "next": next_cursor,
+    }
+
 
-        # Remove stale connections
-        for conn in stale_connections:
-            active_connections.discard(conn)
-        
-        # Update active connections metric
-        set_active_connections(len(active_connections))
-        
-        print(f"Heartbeat sent to {successful_pings} connections, removed {len(stale_connections)} stale connections")
-
-def get_connection_stats():
-    """Get current connection statistics"""
+def describe_connection(conn, now=None):
+    """Stats of one registered connection"""
+    now = time.monotonic() if now is None else now
+    connected_at = registry.connected_at(conn)
+    probe = getattr(conn, 'probe', None)
     return {
-        "active_connections": len(active_connections),
-        "connection_objects": [
-            {
-                "session_id": getattr(conn, 'session_id', 'unknown'),
-                "message_count": getattr(conn, 'count', 0),
-                "active": not getattr(conn, 'closed', True)
-            }
-            for conn in active_connections
-        ]
-    }
\ No newline at end of file
+        "connection_id": registry.connection_id(conn),
+        "session_id": conn.session_id,
+        "client_ip": getattr(conn, 'client_ip', None),
+        "codec": conn.codec.name,
+        "message_count": conn.count,
+        "connected_seconds": round(now - connected_at, 1) if connected_at is not None else None,
+        "idle_seconds": round(now - conn.last_seen, 1),
+        "rtt_seconds": round(probe.rtt, 4) if probe is not None and probe.rtt is not None else None,
+    }
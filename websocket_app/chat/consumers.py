@@ -1,92 +1,365 @@
+from channels.exceptions import ChannelFull
 from channels.generic.websocket import AsyncWebsocketConsumer
-import json
+import asyncio
 import uuid
 import time
-from chat.connection_pool import active_connections
-from chat.session_store import TTLSessionStore
+from urllib.parse import parse_qs
+from chat.connection_pool import (
+    HeartbeatProbe, record_pong, register_connection, registry, unregister_connection
+)
+from chat.registry import DUPLICATE_SESSION_POLICY, SESSION_REPLACED_CLOSE_CODE
+from chat.session_store import create_session_store
+from chat.broadcast import BROADCAST_GROUP, CLIENT_BROADCAST, broadcast
+from chat.codecs import negotiate
+from chat.serialization import loads
+from chat.outbound import OutboundBatcher, OutboundBuffer, SlowConsumer, SLOW_CONSUMER_CLOSE_CODE
+from chat.admission import observe_message_latency
+from chat.tracing import RECEIVED_AT, TRACE_SAMPLE_RATE, MessageTrace, TracedReceive
+from chat.replay import replay_store, requested_seq
+from chat.ratelimit import RATE_LIMIT_CLOSE_CODE, RATE_LIMIT_POLICY, RATE_LIMITED, check_message, client_ip
 import logging
 from chat.metrics import (
     inc_connections, set_active_connections, inc_messages, 
-    record_message_processing_time
+    record_message_processing_time, inc_slow_consumer_evictions, inc_replayed_frames,
+    inc_connections_kicked
 )
 
-session_store = TTLSessionStore()
+session_store = create_session_store()
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    groups = [BROADCAST_GROUP]
+
+    # Per-connection state lives in slots rather than the instance __dict__,
+    # which then only holds the few attributes set by channels itself
+    __slots__ = (
+        "count", "active", "closed", "last_seen", "batcher", "outbound", "evicted", "trace",
+        "owns_session", "probe", "session_id", "client_ip", "codec", "replay", "seq", "throttled",
+    )
+
+    async def __call__(self, scope, receive, send):
+        # Sampled frames get stamped on arrival for the latency breakdown
+        if TRACE_SAMPLE_RATE > 0:
+            receive = TracedReceive(receive)
+        await super().__call__(scope, receive, send)
+
     async def connect(self):
         self.count = 0
         self.active = 0
         self.closed = False
+        self.last_seen = time.monotonic()
+        self.batcher = None
+        self.outbound = OutboundBuffer(self._send_message, on_stall=self.evict_slow_consumer)
+        self.evicted = False
+        self.trace = None
+        self.owns_session = False
+        self.probe = None
+        self.throttled = False  # a rate_limited notice went out since the last admitted message
         
         # Get WebSocket key from scope headers
         headers = dict(self.scope["headers"])
         session_id = headers.get(b'x-session-id')  # header keys are lowercase and bytes
         self.session_id = session_id.decode() if session_id else str(uuid.uuid4())
+        self.client_ip = client_ip(self.scope)
+
+        # Wire format for the whole session, from Sec-WebSocket-Protocol
+        self.codec, subprotocol = negotiate(self.scope.get("subprotocols"))
+
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        # Opt-in (?replay=1): frames carry a seq and are kept for resume
+        self.replay = replay_store.enabled and query.get("replay", ["0"])[0] == "1"
+        self.seq = 0
+
+        # The same X-Session-Id is already connected to this worker
+        duplicates = registry.by_session(self.session_id)
+        if duplicates:
+            logging.info("Duplicate session", extra={
+                "session_id": self.session_id,
+                "connections": len(duplicates),
+                "policy": DUPLICATE_SESSION_POLICY
+            })
+            if DUPLICATE_SESSION_POLICY == "reject_new":
+                inc_connections_kicked("duplicate_rejected")
+                await self.accept(subprotocol=subprotocol)
+                await self.close(code=SESSION_REPLACED_CLOSE_CODE)
+                return
+            if DUPLICATE_SESSION_POLICY == "kick_old":
+                # The old connection saves its state first, so this one resumes from it
+                for old in duplicates:
+                    old.kick("session_replaced", SESSION_REPLACED_CLOSE_CODE)
+        self.owns_session = True
 
         # Try to restore previous state
-        saved = session_store.get(self.session_id)
+        saved = await session_store.aget(self.session_id)
         self.count = saved.get("count", 0) if saved else 0
 
-        await self.accept()
-        await self.send(text_data=json.dumps({
-            "session_id": self.session_id,  # Send back new or existing session ID
-            "resumed": bool(saved),
-            "count": self.count
-        }))
+        replay_from = None
+        if self.replay:
+            kept_seq = replay_store.attach(self.session_id, self.codec)
+            self.seq = max(saved.get("seq", 0) if saved else 0, kept_seq)
+            replay_from = requested_seq(query, headers)
+
+        await self.accept(subprotocol=subprotocol)
+        # Send back new or existing session ID
+        await self.send_frame(self.codec.connect_frame(self.session_id, bool(saved), self.count), sequenced=False)
 
-        active_connections.add(self)
+        # Opt-in (?batch=1): later frames are coalesced into array-framed batches
+        if query.get("batch", ["0"])[0] == "1":
+            self.batcher = OutboundBatcher(self.write_frame, self.codec)
+
+        # Opt-in (?pong=1): the client echoes heartbeat ids, so silence means it is gone
+        self.probe = HeartbeatProbe() if query.get("pong", ["0"])[0] == "1" else None
+
+        # Frames the client missed since the last seq it processed, already seq'd
+        if replay_from is not None:
+            frames = replay_store.since(self.session_id, replay_from)
+            for frame in frames:
+                await self.write_frame(frame)
+            inc_replayed_frames(len(frames))
+
+        register_connection(self)
         
         # Update Prometheus metrics
         inc_connections()
-        set_active_connections(len(active_connections))
+        set_active_connections(len(registry))
         
         logging.info("Client connected", extra={
             "session_id": self.session_id,
             "resumed": bool(saved),
             "count": self.count,
-            "total_active": len(active_connections)
+            "codec": self.codec.name,
+            "replayed_from": replay_from,
+            "total_active": len(registry)
         })
 
-    async def receive(self, text_data):
-        # Record message processing time
-        start_time = time.time()
-        
+    async def send_frame(self, frame, sequenced=True):
+        """
+        Send a frame produced by self.codec, through the batcher when enabled.
+        On replay connections ``sequenced`` frames get the next seq and are kept
+        for resume; connect, bye and heartbeat frames are not worth replaying.
+        """
+        if self.replay and sequenced:
+            self.seq += 1
+            frame = self.codec.add_seq(frame, self.seq)
+            replay_store.append(self.session_id, self.codec, self.seq, frame)
+        if self.batcher is not None:
+            await self.batcher.add(frame)
+        else:
+            await self.write_frame(frame)
+
+    async def write_frame(self, frame):
+        """Write a frame right away, subject to per-connection backpressure"""
+        try:
+            await self.outbound.write(frame)
+        except SlowConsumer:
+            # Already evicted; drop the frame
+            pass
+
+    async def _send_message(self, frame):
+        if isinstance(frame, str):
+            await self.send(text_data=frame)
+        else:
+            await self.send(bytes_data=frame)
+
+    def decode(self, text_data, bytes_data):
+        """
+        Turn an incoming frame into a message. Plain text stays a string (e.g.
+        "exit"), text JSON objects are decoded as JSON and binary frames with the
+        session codec. Returns None for frames that cannot be decoded; they still
+        count as messages.
+        """
+        try:
+            if text_data is not None:
+                return loads(text_data) if text_data.startswith("{") else text_data
+            return self.codec.decode(bytes_data)
+        except Exception:
+            return None
+
+    async def websocket_receive(self, message):
+        received_ns = message.get(RECEIVED_AT)
+        self.trace = MessageTrace(self.session_id, received_ns) if received_ns else None
+        await super().websocket_receive(message)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Record message processing time (monotonic, unaffected by clock jumps)
+        start_time = time.perf_counter()
+        handled_at = None  # stamped before the reply waits on backpressure
+        self.last_seen = time.monotonic()
+        trace = self.trace
+        if trace is not None:
+            trace.start()
+
+        # Throttled frames are not even decoded
+        throttled = check_message(self.session_id, self.client_ip)
+        if throttled:
+            await self.reject_throttled(throttled)
+            return
+        self.throttled = False
+
+        # In flight until the finally below, so a shutdown drain waits for the reply
+        self.active += 1
         try:
-            if text_data == "exit":
-                await self.send(text_data=json.dumps({"bye": True, "total": self.count}))
+            message = self.decode(text_data, bytes_data)
+
+            if message == "exit":
+                handled_at = time.perf_counter()
+                await self.send_frame(self.codec.bye_frame(self.count), sequenced=False)
                 await self.close(code=1001)
                 return
+
+            # Heartbeat echo, not a chat message
+            if isinstance(message, dict) and "pong" in message:
+                record_pong(self, message["pong"])
+                return
             
-            self.active += 1
             self.count += 1
             
             # Update Prometheus metrics
             inc_messages()
             
-            await self.send(text_data=json.dumps({"count": self.count}))
+            # {"broadcast": ...} is relayed to every connected client, only when enabled:
+            # otherwise any anonymous client could push frames to every socket
+            if CLIENT_BROADCAST and isinstance(message, dict) and "broadcast" in message:
+                try:
+                    await broadcast({"broadcast": message["broadcast"], "from": self.session_id})
+                except ChannelFull as e:
+                    # Too large for the channel layer; nobody got it, but the sender keeps its connection
+                    logging.warning("Broadcast refused by the channel layer", extra={
+                        "session_id": self.session_id,
+                        "error": str(e)
+                    })
+            
+            handled_at = time.perf_counter()
+            if trace is None:
+                await self.send_frame(self.codec.count_frame(self.count))
+            else:
+                trace.handled()
+                await self.send_frame(self.codec.count_frame(self.count))
+                # Batched replies leave with their batch; time those up to the hand-off
+                if self.batcher is None:
+                    self.outbound.on_written(trace.sent)
+                else:
+                    trace.sent()
             
         finally:
             self.active -= 1
             
             # Record processing time
-            processing_time = time.time() - start_time
-            record_message_processing_time(processing_time)
+            end_time = time.perf_counter()
+            record_message_processing_time(end_time - start_time)
+            # Admission only sees our own work: a client that stops reading must
+            # not make the whole worker look overloaded
+            observe_message_latency((end_time if handled_at is None else handled_at) - start_time)
+
+    async def reject_throttled(self, scope):
+        """Apply RATE_LIMIT_POLICY to a message over the session or IP limit"""
+        if RATE_LIMIT_POLICY == "close":
+            logging.warning("Closing rate-limited client", extra={
+                "session_id": self.session_id,
+                "client_ip": self.client_ip,
+                "scope": scope
+            })
+            await self.close(code=RATE_LIMIT_CLOSE_CODE)
+        elif not self.throttled:
+            # One notice per throttle episode, so a flood is not echoed frame for frame;
+            # not seq'd or kept for replay either
+            self.throttled = True
+            await self.send_frame(self.codec.encode(RATE_LIMITED), sequenced=False)
+
+    def evict_slow_consumer(self, reason):
+        """Drop a client that stopped reading; its queued frames are discarded"""
+        if self.evicted:
+            return
+        self.evicted = True
+        if self.batcher is not None:
+            self.batcher.discard()
+        unregister_connection(self)
+        set_active_connections(len(registry))
+        self.release_session()
+        inc_slow_consumer_evictions()
+        logging.warning("Evicting slow consumer", extra={
+            "session_id": self.session_id,
+            "reason": reason
+        })
+        asyncio.ensure_future(self.abort(SLOW_CONSUMER_CLOSE_CODE))
+
+    def kick(self, reason, code):
+        """Close this connection from outside (session taken over, admin kick)"""
+        if self.closed or not self.owns_session:
+            return
+        unregister_connection(self)
+        set_active_connections(len(registry))
+        self.release_session()
+        inc_connections_kicked(reason)
+        logging.warning("Kicking connection", extra={
+            "session_id": self.session_id,
+            "reason": reason
+        })
+        asyncio.ensure_future(self.close(code=code))
+
+    async def wait_sent(self):
+        """Wait until every frame sent so far, batched ones included, has been handed to the server"""
+        if self.batcher is not None:
+            await self.batcher.flush()
+        await self.outbound.written()
+
+    async def close(self, code=None):
+        # Anything still batched goes out before the close frame
+        if self.batcher is not None:
+            await self.batcher.flush()
+        await self.outbound.drain()
+        await super().close(code)
+
+    async def abort(self, code):
+        """
+        Close right away for a client that is not reading: queued frames are
+        dropped, since draining them would only block again
+        """
+        if self.batcher is not None:
+            self.batcher.discard()
+        self.outbound.release()
+        await super().close(code)
+
+    def session_state(self):
+        """What the session store keeps for a resume"""
+        if self.replay:
+            return {"count": self.count, "seq": self.seq}
+        return {"count": self.count}
+
+    def release_session(self):
+        """
+        Save the session for a resume and stop recording it for replay. Only the
+        first call does anything, so a connection that was kicked or evicted
+        cannot overwrite the state of the one that took its session over.
+        """
+        if not self.owns_session:
+            return
+        self.owns_session = False
+        session_store.set(self.session_id, self.session_state())
+        if self.replay:
+            replay_store.detach(self.session_id, self.codec, self.seq)
+            self.replay = False
+
+    async def chat_broadcast(self, event):
+        # Already encoded once per codec by the sender; just forward ours
+        await self.send_frame(event["frames"][self.codec.name])
 
     async def disconnect(self, close_code):
         self.closed = True
+        if self.batcher is not None:
+            self.batcher.discard()
+        self.outbound.release()
         
         # Remove from active connections
-        active_connections.discard(self)
+        unregister_connection(self)
         
         # Update metrics
-        set_active_connections(len(active_connections))
+        set_active_connections(len(registry))
         
-        if self.session_id:
-            session_store.set(self.session_id, {"count": self.count})
+        self.release_session()
         
         logging.info("Client disconnected", extra={
             "session_id": self.session_id,
             "total_messages": self.count,
             "close_code": close_code,
-            "remaining_active": len(active_connections)
+            "remaining_active": len(registry)
         })
\ No newline at end of file
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+import time
+from chat import admission
+from chat.connection_pool import registry
+from chat.metrics import inc_drained_connections, set_drain_remaining_connections
+
+logger = logging.getLogger(__name__)
+
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '8'))  # seconds for the whole drain; keep under the stop grace period
+DRAIN_CONCURRENCY = int(os.getenv('DRAIN_CONCURRENCY', '512'))  # connections closing at once
+
+DRAIN_POLL_INTERVAL = 0.05
+
+
+async def _drain_one(conn, deadline):
+    # Let an in-flight message finish so its reply goes out before the bye
+    while getattr(conn, "active", 0) > 0 and time.monotonic() < deadline:
+        await asyncio.sleep(DRAIN_POLL_INTERVAL)
+    if getattr(conn, "closed", False):
+        return
+    await conn.send_frame(conn.codec.bye_frame(conn.count), sequenced=False)
+    await conn.close(code=1001)
+
+
+# The worker's drain, once started; later callers wait for it instead of draining again
+_drain = None
+
+
+async def drain_connections(timeout=DRAIN_TIMEOUT):
+    """
+    Close every connection of this worker for shutdown.
+
+    New handshakes are refused first (admission control reports "draining"),
+    then all connections get their bye frame and close concurrently, at most
+    DRAIN_CONCURRENCY at a time, under one deadline for the whole drain.
+    Each session's count is saved as its connection finishes draining, or
+    when the deadline cuts it off.
+
+    Only the first call drains. Later ones (core.server drains, then the ASGI
+    lifespan shutdown asks again) wait for that drain to finish, so closing
+    connections never get a second bye frame.
+    """
+    global _drain
+    admission.draining = True
+    if _drain is None:
+        _drain = asyncio.ensure_future(_drain_connections(timeout))
+    # Shielded: a cancelled caller must not cut the drain short for the others
+    await asyncio.shield(_drain)
+
+
+async def _drain_connections(timeout):
+    connections = [conn for conn in registry if not getattr(conn, "closed", False)]
+    if not connections:
+        return
+
+    started = time.monotonic()
+    deadline = started + timeout
+    remaining = len(connections)
+    set_drain_remaining_connections(remaining)
+    logger.info("Draining connections", extra={"connections": remaining, "timeout": timeout})
+
+    semaphore = asyncio.Semaphore(DRAIN_CONCURRENCY)
+
+    async def drain(conn):
+        nonlocal remaining
+        try:
+            async with semaphore:
+                await _drain_one(conn, deadline)
+            inc_drained_connections("closed")
+        except Exception as e:
+            inc_drained_connections("failed")
+            logger.warning("Failed to drain connection", extra={
+                "session_id": getattr(conn, "session_id", None),
+                "error": repr(e)
+            })
+        finally:
+            conn.release_session()
+            remaining -= 1
+            set_drain_remaining_connections(remaining)
+
+    tasks = [asyncio.ensure_future(drain(conn)) for conn in connections]
+    _, pending = await asyncio.wait(tasks, timeout=max(0.0, deadline - time.monotonic()))
+    if pending:
+        for task in pending:
+            task.cancel()
+        await asyncio.wait(pending)
+        inc_drained_connections("timed_out", len(pending))
+
+    logger.info("Drain finished", extra={
+        "connections": len(connections),
+        "timed_out": len(pending),
+        "duration_seconds": round(time.monotonic() - started, 3)
+    })
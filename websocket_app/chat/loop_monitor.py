@@ -0,0 +1,143 @@
+import asyncio
+import gc
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from chat.metrics import inc_slow_callbacks, record_gc_pause, record_loop_lag, set_event_loop_tasks
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.1'))  # seconds between samples
+LOOP_TASKS_INTERVAL = float(os.getenv('LOOP_TASKS_INTERVAL', '1'))  # seconds between task counts
+SLOW_CALLBACK_THRESHOLD = float(os.getenv('SLOW_CALLBACK_THRESHOLD', '0.25'))  # seconds the loop may be blocked
+
+# Smoothed event-loop scheduling delay of this process, in seconds
+loop_lag = 0.0
+# Tasks alive on the loop at the last count
+loop_tasks = 0
+# Loop stalls seen by the watchdog, and the coroutine caught in the last one
+slow_callbacks = 0
+last_slow_callback = None
+# GC pauses of this process
+gc_pauses = 0
+gc_pause_seconds = 0.0
+
+# monotonic time the sampler last ran, read by the watchdog thread
+_last_tick = 0.0
+_gc_started = None
+
+
+async def monitor_event_loop():
+    """
+    Sample how late the event loop wakes up a sleeping task. Callbacks that hog
+    the loop or a saturated CPU delay every coroutine by about this much.
+
+    Also starts the stall watchdog and the GC pause hook for this process.
+    """
+    global loop_lag, loop_tasks, _last_tick
+    _start_watchdog(threading.get_ident())
+    gc.callbacks.append(_on_gc)
+
+    interval = LOOP_LAG_INTERVAL
+    next_count = 0.0
+    _last_tick = time.monotonic()
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        _last_tick = now = time.monotonic()
+        lag = max(0.0, now - started - interval)
+        record_loop_lag(lag)
+        # Rise immediately, recover gradually
+        loop_lag = lag if lag > loop_lag else loop_lag * 0.8 + lag * 0.2
+
+        # all_tasks() walks every task, so count far less often than we sample
+        if now >= next_count:
+            loop_tasks = len(asyncio.all_tasks())
+            set_event_loop_tasks(loop_tasks)
+            next_count = now + LOOP_TASKS_INTERVAL
+
+
+# Slow callbacks
+
+def _start_watchdog(loop_thread_id):
+    thread = threading.Thread(
+        target=_watchdog, args=(loop_thread_id,), name="loop-watchdog", daemon=True
+    )
+    thread.start()
+
+
+def _watchdog(loop_thread_id):
+    """
+    Runs in its own thread. When the sampler has not ticked for longer than
+    SLOW_CALLBACK_THRESHOLD the loop is stuck in one callback; grab the loop
+    thread's stack to name the coroutine holding it. uvloop does not run
+    callbacks through asyncio.Handle, so this is the only way to see them there.
+    """
+    global slow_callbacks, last_slow_callback
+    reported_tick = None
+    check_every = min(SLOW_CALLBACK_THRESHOLD / 2, LOOP_LAG_INTERVAL)
+    while True:
+        time.sleep(check_every)
+        tick = _last_tick
+        if tick == reported_tick:
+            continue
+        blocked = time.monotonic() - tick - LOOP_LAG_INTERVAL
+        if blocked < SLOW_CALLBACK_THRESHOLD:
+            continue
+
+        frame = sys._current_frames().get(loop_thread_id)
+        if frame is None:
+            return
+        reported_tick = tick
+        coroutine = _running_coroutine(frame)
+        slow_callbacks += 1
+        last_slow_callback = coroutine
+        inc_slow_callbacks(coroutine)
+        logger.warning("Event loop blocked", extra={
+            "blocked_seconds": round(blocked, 3),
+            "coroutine": coroutine,
+            "stack": "".join(traceback.format_stack(frame, limit=15)),
+        })
+
+
+def _running_coroutine(frame):
+    """Qualified name of the innermost coroutine on a stack, else of its top function"""
+    top = frame
+    while frame is not None:
+        if frame.f_code.co_flags & inspect.CO_COROUTINE:
+            break
+        frame = frame.f_back
+    frame = frame or top
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+# GC pauses
+
+def _on_gc(phase, info):
+    global _gc_started, gc_pauses, gc_pause_seconds
+    if phase == "start":
+        _gc_started = time.perf_counter()
+    elif _gc_started is not None:
+        pause = time.perf_counter() - _gc_started
+        _gc_started = None
+        gc_pauses += 1
+        gc_pause_seconds += pause
+        record_gc_pause(info["generation"], pause)
+
+
+def get_loop_stats():
+    """This process's event-loop health, for /observability/"""
+    return {
+        "lag_seconds": round(loop_lag, 4),
+        "tasks": loop_tasks,
+        "slow_callbacks": slow_callbacks,
+        "last_slow_callback": last_slow_callback,
+        "gc_pauses": gc_pauses,
+        "gc_pause_seconds": round(gc_pause_seconds, 4),
+    }
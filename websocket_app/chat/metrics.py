@@ -1,11 +1,24 @@
 from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from prometheus_client.core import CollectorRegistry
+from prometheus_client import multiprocess
+from prometheus_client.exposition import choose_encoder
+from bisect import bisect_left
+import gzip
+import threading
 import time
 import os
 
 # Create a custom registry for this application
 registry = CollectorRegistry()
 
+# Multi-worker mode: when PROMETHEUS_MULTIPROC_DIR is set (see docker-entrypoint.sh)
+# every worker writes its samples to files there and exposition aggregates them.
+# The gauge multiprocess_mode arguments below only matter in that mode.
+MULTIPROCESS_MODE = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+# /metrics/ renders at most once per this many seconds; 0 renders on every scrape
+METRICS_CACHE_TTL = float(os.getenv('METRICS_CACHE_TTL', '1'))
+
 # Define Prometheus metrics
 websocket_connections_total = Counter(
     'websocket_connections_total',
@@ -18,6 +31,7 @@ websocket_connections_active = Gauge(
     'websocket_connections_active',
     'Number of currently active WebSocket connections',
     ['deployment_color'],
+    multiprocess_mode='livesum',
     registry=registry
 )
 
@@ -42,10 +56,191 @@ websocket_message_processing_duration = Histogram(
     registry=registry
 )
 
+websocket_message_stage_duration = Histogram(
+    'websocket_message_stage_duration_seconds',
+    'Latency of sampled messages by stage: queue, handler, send and total',
+    ['deployment_color', 'stage'],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    registry=registry
+)
+
+websocket_heartbeat_cycle_duration = Histogram(
+    'websocket_heartbeat_cycle_duration_seconds',
+    'Time taken to send one heartbeat tick (one time-wheel bucket)',
+    ['deployment_color'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    registry=registry
+)
+
+websocket_heartbeat_send_duration = Histogram(
+    'websocket_heartbeat_send_duration_seconds',
+    'Time taken by a single heartbeat send',
+    ['deployment_color'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+    registry=registry
+)
+
+websocket_heartbeat_rtt = Histogram(
+    'websocket_heartbeat_rtt_seconds',
+    'Round trip from a heartbeat send to the client echoing its id, for ?pong=1 clients',
+    ['deployment_color'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    registry=registry
+)
+
+websocket_heartbeat_pong_timeouts_total = Counter(
+    'websocket_heartbeat_pong_timeouts_total',
+    'Total number of connections evicted for missing consecutive heartbeat pongs',
+    ['deployment_color'],
+    registry=registry
+)
+
+websocket_outbound_batch_size = Histogram(
+    'websocket_outbound_batch_size',
+    'Number of frames coalesced into one outbound batch',
+    ['deployment_color'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+    registry=registry
+)
+
+websocket_outbound_buffered_bytes = Gauge(
+    'websocket_outbound_buffered_bytes',
+    'Outbound bytes handed to the server but not yet written to client sockets',
+    ['deployment_color'],
+    multiprocess_mode='livesum',
+    registry=registry
+)
+
+websocket_slow_consumer_evictions_total = Counter(
+    'websocket_slow_consumer_evictions_total',
+    'Total number of connections closed for not reading their outbound data',
+    ['deployment_color'],
+    registry=registry
+)
+
+websocket_replay_buffer_bytes = Gauge(
+    'websocket_replay_buffer_bytes',
+    'Bytes of outbound frames kept for replay to reconnecting sessions',
+    ['deployment_color'],
+    multiprocess_mode='livesum',
+    registry=registry
+)
+
+websocket_replayed_frames_total = Counter(
+    'websocket_replayed_frames_total',
+    'Total number of frames resent to resumed sessions',
+    ['deployment_color'],
+    registry=registry
+)
+
+event_loop_lag = Histogram(
+    'websocket_event_loop_lag_seconds',
+    'Delay between when the event loop should have woken a task and when it did',
+    ['deployment_color'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    registry=registry
+)
+
+event_loop_tasks = Gauge(
+    'websocket_event_loop_tasks',
+    'Number of asyncio tasks alive on the event loop',
+    ['deployment_color'],
+    multiprocess_mode='livesum',
+    registry=registry
+)
+
+event_loop_slow_callbacks_total = Counter(
+    'websocket_event_loop_slow_callbacks_total',
+    'Total number of times one callback blocked the event loop for too long',
+    ['deployment_color', 'coroutine'],
+    registry=registry
+)
+
+gc_pause_duration = Histogram(
+    'websocket_gc_pause_duration_seconds',
+    'Time the interpreter spent in garbage collection passes',
+    ['deployment_color', 'generation'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    registry=registry
+)
+
+websocket_connections_kicked_total = Counter(
+    'websocket_connections_kicked_total',
+    'Total number of connections closed by the server for their session: replaced, duplicate or admin kick',
+    ['deployment_color', 'reason'],
+    registry=registry
+)
+
+websocket_connections_rejected_total = Counter(
+    'websocket_connections_rejected_total',
+    'Total number of WebSocket handshakes turned away by admission control',
+    ['deployment_color', 'reason'],
+    registry=registry
+)
+
+websocket_messages_throttled_total = Counter(
+    'websocket_messages_throttled_total',
+    'Total number of inbound messages rejected by the rate limiter',
+    ['deployment_color', 'scope'],
+    registry=registry
+)
+
+websocket_drain_remaining_connections = Gauge(
+    'websocket_drain_remaining_connections',
+    'Connections still being closed by a shutdown drain',
+    ['deployment_color'],
+    multiprocess_mode='livesum',
+    registry=registry
+)
+
+websocket_drained_connections_total = Counter(
+    'websocket_drained_connections_total',
+    'Total number of connections handled by shutdown drains, by outcome',
+    ['deployment_color', 'result'],
+    registry=registry
+)
+
+log_records_dropped_total = Counter(
+    'log_records_dropped_total',
+    'Total number of log records dropped because the logging queue was full',
+    ['deployment_color'],
+    registry=registry
+)
+
+websocket_compression_raw_bytes_total = Counter(
+    'websocket_compression_raw_bytes_total',
+    'Outbound message payload bytes before permessage-deflate',
+    ['deployment_color', 'result'],
+    registry=registry
+)
+
+websocket_compression_compressed_bytes_total = Counter(
+    'websocket_compression_compressed_bytes_total',
+    'Outbound payload bytes after permessage-deflate, for compressed messages',
+    ['deployment_color'],
+    registry=registry
+)
+
+session_store_entries = Gauge(
+    'session_store_entries',
+    'Number of sessions held in process memory by the session store',
+    ['deployment_color'],
+    multiprocess_mode='livesum',
+    registry=registry
+)
+
+session_store_evictions_total = Counter(
+    'session_store_evictions_total',
+    'Total number of sessions evicted from process memory by the session store',
+    ['deployment_color', 'reason'],
+    registry=registry
+)
+
 application_uptime_seconds = Gauge(
     'application_uptime_seconds',
     'Application uptime in seconds',
     ['deployment_color'],
+    multiprocess_mode='livemax',
     registry=registry
 )
 
@@ -55,36 +250,365 @@ app_start_time = time.time()
 # Get deployment color from environment
 deployment_color = os.getenv('DEPLOYMENT_COLOR', 'unknown')
 
+# Buffered metrics are pushed to Prometheus this often (and before every render)
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1'))
+
+
+class BufferedCounter:
+    """
+    Counter child updated with a plain int add, pushed to Prometheus by flush().
+
+    Single writer: only the event-loop thread may call inc(). The value is
+    cumulative and never reset, so flush() can run on any thread and push the
+    difference since its last flush without locking against the writer.
+    """
+    __slots__ = ('_child', 'value', '_flushed')
+
+    def __init__(self, child):
+        self._child = child
+        self.value = 0
+        self._flushed = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def flush(self):
+        value = self.value
+        if value != self._flushed:
+            self._child.inc(value - self._flushed)
+            self._flushed = value
+
+
+class BufferedHistogram:
+    """
+    Histogram child that counts observations into a local bucket array.
+
+    Same single-writer rule as BufferedCounter. flush() adds the per-bucket
+    deltas straight into the child's bucket values; that relies on
+    prometheus_client internals (_upper_bounds, _buckets, _sum), hence the
+    pinned prometheus-client version.
+    """
+    __slots__ = ('_child', '_bounds', 'counts', 'sum', '_flushed_counts', '_flushed_sum')
+
+    def __init__(self, child):
+        self._child = child
+        self._bounds = list(child._upper_bounds)
+        self.counts = [0] * len(self._bounds)
+        self.sum = 0.0
+        self._flushed_counts = [0] * len(self._bounds)
+        self._flushed_sum = 0.0
+
+    def observe(self, amount):
+        self.sum += amount
+        self.counts[bisect_left(self._bounds, amount)] += 1
+
+    def flush(self):
+        counts = self.counts[:]
+        total = self.sum
+        flushed = self._flushed_counts
+        for i, count in enumerate(counts):
+            if count != flushed[i]:
+                self._child._buckets[i].inc(count - flushed[i])
+                flushed[i] = count
+        if total != self._flushed_sum:
+            self._child._sum.inc(total - self._flushed_sum)
+            self._flushed_sum = total
+
+
+class BufferedGauge:
+    """Gauge child whose latest set() is pushed to Prometheus by flush()"""
+    __slots__ = ('_child', 'value', '_flushed')
+
+    def __init__(self, child):
+        self._child = child
+        self.value = 0
+        self._flushed = None
+
+    def set(self, value):
+        self.value = value
+
+    def flush(self):
+        value = self.value
+        if value != self._flushed:
+            self._child.set(value)
+            self._flushed = value
+
+
+# Children bound to this deployment color once, instead of a labels() lookup per call
+_connections_total = websocket_connections_total.labels(deployment_color=deployment_color)
+_connections_active = websocket_connections_active.labels(deployment_color=deployment_color)
+_replayed_frames = websocket_replayed_frames_total.labels(deployment_color=deployment_color)
+_slow_consumer_evictions = websocket_slow_consumer_evictions_total.labels(deployment_color=deployment_color)
+_heartbeat_pong_timeouts = websocket_heartbeat_pong_timeouts_total.labels(deployment_color=deployment_color)
+_heartbeat_cycle_duration = websocket_heartbeat_cycle_duration.labels(deployment_color=deployment_color)
+_event_loop_tasks = event_loop_tasks.labels(deployment_color=deployment_color)
+_drain_remaining = websocket_drain_remaining_connections.labels(deployment_color=deployment_color)
+_log_records_dropped = log_records_dropped_total.labels(deployment_color=deployment_color)
+_session_store_entries = session_store_entries.labels(deployment_color=deployment_color)
+_uptime = application_uptime_seconds.labels(deployment_color=deployment_color)
+_connections_kicked = {
+    reason: websocket_connections_kicked_total.labels(deployment_color=deployment_color, reason=reason)
+    for reason in ('session_replaced', 'duplicate_rejected', 'admin')
+}
+_drained_connections = {
+    result: websocket_drained_connections_total.labels(deployment_color=deployment_color, result=result)
+    for result in ('closed', 'failed', 'timed_out')
+}
+# Evictions are also counted from executor threads (SQLite read-through), so not buffered
+_session_store_evictions = {
+    reason: session_store_evictions_total.labels(deployment_color=deployment_color, reason=reason)
+    for reason in ('expired', 'capacity')
+}
+# GC passes run on whichever thread triggered them, so these cannot be single-writer buffers
+_gc_pauses = {
+    generation: gc_pause_duration.labels(deployment_color=deployment_color, generation=str(generation))
+    for generation in (0, 1, 2)
+}
+# Slow callbacks are labelled by coroutine name, so children are bound on first use
+_slow_callbacks = {}
+
+# Per-message and per-frame paths, all recorded from the event-loop thread
+_messages = BufferedCounter(websocket_messages_total.labels(deployment_color=deployment_color))
+_message_processing_duration = BufferedHistogram(websocket_message_processing_duration.labels(deployment_color=deployment_color))
+_message_stages = {
+    stage: BufferedHistogram(websocket_message_stage_duration.labels(deployment_color=deployment_color, stage=stage))
+    for stage in ('queue', 'handler', 'send', 'total')
+}
+_heartbeat_pings = BufferedCounter(websocket_heartbeat_pings_total.labels(deployment_color=deployment_color))
+_heartbeat_send_duration = BufferedHistogram(websocket_heartbeat_send_duration.labels(deployment_color=deployment_color))
+_heartbeat_rtt = BufferedHistogram(websocket_heartbeat_rtt.labels(deployment_color=deployment_color))
+_outbound_batch_size = BufferedHistogram(websocket_outbound_batch_size.labels(deployment_color=deployment_color))
+_outbound_buffered_bytes = BufferedGauge(websocket_outbound_buffered_bytes.labels(deployment_color=deployment_color))
+_replay_buffer_bytes = BufferedGauge(websocket_replay_buffer_bytes.labels(deployment_color=deployment_color))
+_loop_lag = BufferedHistogram(event_loop_lag.labels(deployment_color=deployment_color))
+_compressed_raw_bytes = BufferedCounter(websocket_compression_raw_bytes_total.labels(deployment_color=deployment_color, result='compressed'))
+_compressed_bytes = BufferedCounter(websocket_compression_compressed_bytes_total.labels(deployment_color=deployment_color))
+_skipped_raw_bytes = BufferedCounter(websocket_compression_raw_bytes_total.labels(deployment_color=deployment_color, result='skipped'))
+_connections_rejected = {
+    reason: BufferedCounter(websocket_connections_rejected_total.labels(deployment_color=deployment_color, reason=reason))
+    for reason in ('connections', 'loop_lag', 'message_latency', 'draining')
+}
+_messages_throttled = {
+    scope: BufferedCounter(websocket_messages_throttled_total.labels(deployment_color=deployment_color, scope=scope))
+    for scope in ('session', 'ip')
+}
+
+_buffered = (
+    _messages, _message_processing_duration, _heartbeat_pings, _heartbeat_send_duration, _heartbeat_rtt,
+    _outbound_batch_size, _outbound_buffered_bytes, _replay_buffer_bytes, _loop_lag,
+    _compressed_raw_bytes, _compressed_bytes, _skipped_raw_bytes,
+    *_message_stages.values(), *_connections_rejected.values(), *_messages_throttled.values(),
+)
+_flush_lock = threading.Lock()
+_flusher = None
+
+def flush_metrics():
+    """Push buffered hot-path observations into the Prometheus metrics"""
+    with _flush_lock:
+        for metric in _buffered:
+            metric.flush()
+
+def _flush_loop(interval):
+    while True:
+        time.sleep(interval)
+        flush_metrics()
+
+def start_metrics_flusher(interval=METRICS_FLUSH_INTERVAL):
+    """Flush on a timer too, so other workers' scrapes see this worker's values"""
+    global _flusher
+    if _flusher is not None:
+        return
+    _flusher = threading.Thread(target=_flush_loop, args=(interval,), name="metrics-flush", daemon=True)
+    _flusher.start()
+
 def inc_connections():
     """Increment total connections counter"""
-    websocket_connections_total.labels(deployment_color=deployment_color).inc()
+    _connections_total.inc()
 
 def set_active_connections(count):
     """Set current active connections count"""
-    websocket_connections_active.labels(deployment_color=deployment_color).set(count)
+    _connections_active.set(count)
 
 def inc_messages():
     """Increment total messages counter"""
-    websocket_messages_total.labels(deployment_color=deployment_color).inc()
+    _messages.inc()
 
 def inc_heartbeat_pings():
     """Increment heartbeat pings counter"""
-    websocket_heartbeat_pings_total.labels(deployment_color=deployment_color).inc()
+    _heartbeat_pings.inc()
 
 def record_message_processing_time(duration):
     """Record message processing time"""
-    websocket_message_processing_duration.labels(deployment_color=deployment_color).observe(duration)
+    _message_processing_duration.observe(duration)
+
+def record_message_stage(stage, duration):
+    """Record one stage of a sampled message: queue, handler, send or total"""
+    _message_stages[stage].observe(duration)
+
+def record_heartbeat_cycle_duration(duration):
+    """Record the duration of a heartbeat tick"""
+    _heartbeat_cycle_duration.observe(duration)
+
+def record_heartbeat_send_duration(duration):
+    """Record the latency of a single heartbeat send"""
+    _heartbeat_send_duration.observe(duration)
+
+def record_heartbeat_rtt(seconds):
+    """Record one heartbeat round trip"""
+    _heartbeat_rtt.observe(seconds)
+
+def inc_heartbeat_pong_timeouts(count=1):
+    """Increment connections evicted for missed pongs"""
+    _heartbeat_pong_timeouts.inc(count)
+
+def record_outbound_batch_size(size):
+    """Record how many frames went out in one batch"""
+    _outbound_batch_size.observe(size)
+
+def set_outbound_buffered_bytes(size):
+    """Set the outbound bytes still waiting to be written"""
+    _outbound_buffered_bytes.set(size)
+
+def inc_connections_kicked(reason):
+    """Increment connections kicked, by reason"""
+    _connections_kicked[reason].inc()
+
+def inc_slow_consumer_evictions():
+    """Increment slow-consumer evictions counter"""
+    _slow_consumer_evictions.inc()
+
+def set_replay_buffer_bytes(size):
+    """Set the bytes held by the replay buffers"""
+    _replay_buffer_bytes.set(size)
+
+def inc_replayed_frames(count):
+    """Increment frames resent on resume"""
+    _replayed_frames.inc(count)
+
+def record_loop_lag(seconds):
+    """Record one event-loop lag sample"""
+    _loop_lag.observe(seconds)
+
+def set_event_loop_tasks(count):
+    """Set the number of tasks alive on the event loop"""
+    _event_loop_tasks.set(count)
+
+def inc_slow_callbacks(coroutine):
+    """Increment slow-callback counter for the coroutine that blocked the loop"""
+    child = _slow_callbacks.get(coroutine)
+    if child is None:
+        child = _slow_callbacks[coroutine] = event_loop_slow_callbacks_total.labels(
+            deployment_color=deployment_color, coroutine=coroutine
+        )
+    child.inc()
+
+def record_gc_pause(generation, seconds):
+    """Record one garbage collection pass"""
+    _gc_pauses[generation].observe(seconds)
+
+def inc_connections_rejected(reason):
+    """Increment rejected handshakes counter"""
+    _connections_rejected[reason].inc()
+
+def inc_messages_throttled(scope):
+    """Increment throttled messages counter for a limiter scope (session or ip)"""
+    _messages_throttled[scope].inc()
+
+def record_compressed_bytes(raw_size, compressed_size):
+    """Record a frame that went through permessage-deflate"""
+    _compressed_raw_bytes.inc(raw_size)
+    _compressed_bytes.inc(compressed_size)
+
+def record_uncompressed_bytes(raw_size):
+    """Record a frame sent raw because it was under the compression threshold"""
+    _skipped_raw_bytes.inc(raw_size)
+
+def set_drain_remaining_connections(count):
+    """Set the connections a running drain still has to close"""
+    _drain_remaining.set(count)
+
+def inc_drained_connections(result, count=1):
+    """Increment drained connections; result is 'closed', 'failed' or 'timed_out'"""
+    _drained_connections[result].inc(count)
+
+def inc_log_records_dropped():
+    """Increment dropped log records counter; safe from any thread"""
+    _log_records_dropped.inc()
+
+def set_session_store_entries(count):
+    """Set the number of sessions held in memory"""
+    _session_store_entries.set(count)
+
+def inc_session_store_evictions(reason, count=1):
+    """Increment session evictions; reason is 'expired' or 'capacity'"""
+    _session_store_evictions[reason].inc(count)
 
 def update_uptime():
     """Update application uptime"""
     uptime = time.time() - app_start_time
-    application_uptime_seconds.labels(deployment_color=deployment_color).set(uptime)
+    _uptime.set(uptime)
+
+def collection_registry():
+    """Registry to expose: this process's metrics, or all workers' in multi-worker mode"""
+    if not MULTIPROCESS_MODE:
+        return registry
+    aggregate = CollectorRegistry()
+    multiprocess.MultiProcessCollector(aggregate)
+    return aggregate
+
+def get_metric_totals(*sample_names):
+    """Sum the current value of each named sample across labels (and workers)"""
+    flush_metrics()
+    totals = dict.fromkeys(sample_names, 0)
+    for metric in collection_registry().collect():
+        for sample in metric.samples:
+            if sample.name in totals:
+                totals[sample.name] += sample.value
+    return totals
+
+def get_active_connections_total():
+    """Active WebSocket connections summed over every worker"""
+    return int(get_metric_totals('websocket_connections_active')['websocket_connections_active'])
+
+def mark_worker_dead():
+    """Drop this worker's live gauges from the aggregate; call on shutdown"""
+    flush_metrics()
+    if MULTIPROCESS_MODE:
+        multiprocess.mark_process_dead(os.getpid())
 
 def get_metrics_text():
     """Generate Prometheus metrics text"""
     # Update uptime before generating metrics
     update_uptime()
-    return generate_latest(registry).decode('utf-8')
+    flush_metrics()
+    return generate_latest(collection_registry()).decode('utf-8')
+
+# content type -> [rendered_at, body, gzipped body or None]
+_exposition_cache = {}
+_exposition_lock = threading.Lock()
+
+def render_metrics(accept=None, gzipped=False):
+    """
+    Exposition body and content type for a scrape.
+
+    The format (Prometheus text or OpenMetrics) is negotiated from the Accept
+    header. Each format is rendered at most once per METRICS_CACHE_TTL and
+    gzipped at most once per render; concurrent scrapes wait for a single
+    render instead of each walking the registry.
+    """
+    encoder, content_type = choose_encoder(accept)
+    with _exposition_lock:
+        entry = _exposition_cache.get(content_type)
+        if entry is None or time.monotonic() - entry[0] >= METRICS_CACHE_TTL:
+            update_uptime()
+            flush_metrics()
+            entry = [time.monotonic(), encoder(collection_registry()), None]
+            _exposition_cache[content_type] = entry
+        if not gzipped:
+            return entry[1], content_type
+        if entry[2] is None:
+            entry[2] = gzip.compress(entry[1], compresslevel=6)
+        return entry[2], content_type
 
 # Legacy compatibility (keep for now to avoid breaking existing code)
 from collections import defaultdict
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from chat.metrics import record_outbound_batch_size, set_outbound_buffered_bytes
+
+logger = logging.getLogger(__name__)
+
+# Coalescing for clients that connect with ?batch=1
+OUTBOUND_BATCH_MAX_SIZE = int(os.getenv('OUTBOUND_BATCH_MAX_SIZE', '64'))  # frames per batch
+OUTBOUND_BATCH_MAX_DELAY = float(os.getenv('OUTBOUND_BATCH_MAX_DELAY', '0.005'))  # seconds; 0 = next loop tick
+
+# Backpressure: bytes handed to the server but not yet written out, per connection
+OUTBOUND_HIGH_WATERMARK = int(os.getenv('OUTBOUND_HIGH_WATERMARK', str(256 * 1024)))
+OUTBOUND_LOW_WATERMARK = int(os.getenv('OUTBOUND_LOW_WATERMARK', str(64 * 1024)))
+SLOW_CONSUMER_TIMEOUT = float(os.getenv('SLOW_CONSUMER_TIMEOUT', '10'))  # seconds paused before eviction
+
+# Close code sent to clients evicted for not reading (private-use range)
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+# Sum of OutboundBuffer.buffered over every connection in this process
+_total_buffered = 0
+
+
+class SlowConsumer(Exception):
+    """The connection was evicted for staying above the high watermark"""
+
+
+class OutboundBuffer:
+    """
+    Per-connection outbound queue with byte accounting and backpressure.
+
+    ``write()`` queues the frame and returns; a single writer task per connection
+    hands queued frames to uvicorn one at a time and exits once the queue is
+    empty. Keeping one write in flight also means a stalled send can be cancelled
+    before the close frame goes out.
+
+    Once the queued bytes reach the high watermark, ``write()`` pauses its caller
+    until they fall to the low watermark. If that takes longer than
+    ``stall_timeout`` the queue is dropped, ``on_stall`` is called to evict the
+    client and further writes raise SlowConsumer.
+    """
+
+    __slots__ = (
+        "_write_frame", "_on_stall", "high_watermark", "low_watermark", "stall_timeout",
+        "buffered", "stalled", "_queue", "_queued", "_written", "_waiters", "_writer",
+        "_error", "_paused", "_stall_timer",
+    )
+
+    def __init__(self, write_frame, on_stall, high_watermark=OUTBOUND_HIGH_WATERMARK,
+                 low_watermark=OUTBOUND_LOW_WATERMARK, stall_timeout=SLOW_CONSUMER_TIMEOUT):
+        self._write_frame = write_frame
+        self._on_stall = on_stall
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.stall_timeout = stall_timeout
+        self.buffered = 0
+        self.stalled = False
+        # Idle connections far outnumber busy ones, so the queue, the on_written()
+        # waiters and the pause future only exist while they are in use
+        self._queue = None
+        self._queued = 0  # frames ever queued / written, to resolve on_written()
+        self._written = 0
+        self._waiters = None
+        self._writer = None
+        self._error = None
+        self._paused = None  # future resolved once back under the low watermark
+        self._stall_timer = None
+
+    async def write(self, frame):
+        if self._paused is not None:
+            # Shielded: a cancelled writer must not wake the other paused ones
+            await asyncio.shield(self._paused)
+        if self.stalled:
+            raise SlowConsumer(f"evicted after {self.stall_timeout}s above the high watermark")
+        if self._error is not None:
+            raise self._error
+
+        if self._queue is None:
+            self._queue = deque()
+        self._queue.append(frame)
+        self._queued += 1
+        self._account(len(frame))
+        if self.buffered >= self.high_watermark and self._paused is None:
+            loop = asyncio.get_running_loop()
+            self._paused = loop.create_future()
+            self._stall_timer = loop.call_later(self.stall_timeout, self._stall)
+        if self._writer is None:
+            self._writer = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            while self._queue:
+                frame = self._queue[0]
+                await self._write_frame(frame)
+                self._queue.popleft()
+                self._written += 1
+                self._account(-len(frame))
+                while self._waiters and self._waiters[0][0] <= self._written:
+                    self._waiters.popleft()[1]()
+                if self.buffered <= self.low_watermark and self._paused is not None:
+                    self._resume()
+        except Exception as e:
+            # The connection is gone; the caller of the next write() finds out
+            self._error = e
+            self._clear()
+        finally:
+            if self._writer is asyncio.current_task():
+                self._writer = None
+                if not self._queue:
+                    self._queue = None
+                if not self._waiters:
+                    self._waiters = None
+
+    def _account(self, size):
+        global _total_buffered
+        self.buffered += size
+        _total_buffered += size
+        set_outbound_buffered_bytes(_total_buffered)
+
+    def on_written(self, callback):
+        """Call ``callback()`` once every frame queued so far has been written"""
+        if not self._queue:
+            callback()
+        else:
+            if self._waiters is None:
+                self._waiters = deque()
+            self._waiters.append((self._queued, callback))
+
+    async def written(self):
+        """
+        Wait until every frame queued so far has been written. Never returns if
+        the queue is dropped first; callers bound it with a timeout.
+        """
+        if not self._queue:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.on_written(lambda: future.done() or future.set_result(None))
+        await future
+
+    def _clear(self):
+        if self.buffered:
+            self._account(-self.buffered)
+        if self._queue is not None:
+            self._written += len(self._queue)
+            self._queue = None
+        self._waiters = None
+        self._resume()
+
+    def _resume(self):
+        if self._stall_timer is not None:
+            self._stall_timer.cancel()
+            self._stall_timer = None
+        if self._paused is not None:
+            self._paused.set_result(None)
+            self._paused = None
+
+    def _stall(self):
+        self._stall_timer = None
+        self.stalled = True
+        buffered = self.buffered
+        self.release()
+        self._on_stall(f"{buffered} bytes queued for over {self.stall_timeout}s")
+
+    async def drain(self, timeout=None):
+        """Wait for queued frames to be written; give up on them after ``timeout``"""
+        writer = self._writer
+        if writer is None:
+            return
+        await asyncio.wait((writer,), timeout=timeout if timeout is not None else self.stall_timeout)
+        self.release()
+
+    def release(self):
+        """Drop queued frames and wake paused writers of a connection that is going away"""
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        self._clear()
+
+
+class OutboundBatcher:
+    """
+    Per-connection outbound queue that coalesces frames into one array frame.
+
+    Frames added within ``max_delay`` of the first queued one (or within the same
+    event-loop tick when ``max_delay`` is 0) go out together as a single
+    WebSocket message, built by the codec from the already-encoded frames. A batch
+    is sent as soon as it reaches ``max_size``.
+    """
+
+    def __init__(self, write_frame, codec, max_size=OUTBOUND_BATCH_MAX_SIZE, max_delay=OUTBOUND_BATCH_MAX_DELAY):
+        self._write_frame = write_frame
+        self._codec = codec
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._frames = []
+        self._timer = None
+
+    async def add(self, frame):
+        self._frames.append(frame)
+        if len(self._frames) >= self.max_size:
+            await self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            if self.max_delay > 0:
+                self._timer = loop.call_later(self.max_delay, self._flush_later)
+            else:
+                self._timer = loop.call_soon(self._flush_later)
+
+    def _flush_later(self):
+        self._timer = None
+        asyncio.ensure_future(self._flush_quietly())
+
+    async def _flush_quietly(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            # The connection is going away; disconnect() cleans up
+            logger.debug("Outbound batch flush failed", extra={"error": str(e)})
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._frames:
+            return
+        frames, self._frames = self._frames, []
+        record_outbound_batch_size(len(frames))
+        await self._write_frame(self._codec.join_frames(frames))
+
+    def discard(self):
+        """Drop anything still queued; the socket is gone"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._frames = []
@@ -0,0 +1,85 @@
+import logging
+import os
+import resource
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PROCESS_STATS_INTERVAL = float(os.getenv('PROCESS_STATS_INTERVAL', '5'))  # seconds between samples
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# Latest sample of this process; replaced whole, so readers never see a partial one
+_stats = {}
+_sampler = None
+
+
+def _read_proc():
+    """RSS, CPU seconds and thread count from /proc/self (Linux)"""
+    with open('/proc/self/stat', 'rb') as f:
+        # The command name may contain spaces; the fixed fields start after its ")"
+        fields = f.read().rsplit(b')', 1)[1].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    threads = int(fields[17])
+    with open('/proc/self/statm', 'rb') as f:
+        rss_pages = int(f.read().split()[1])
+    open_fds = len(os.listdir('/proc/self/fd'))
+    return rss_pages * PAGE_SIZE, (utime + stime) / CLOCK_TICKS, open_fds, threads
+
+
+def _read_rusage():
+    """Fallback without /proc; ru_maxrss is the peak, not current, RSS"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_maxrss * 1024, usage.ru_utime + usage.ru_stime, None, threading.active_count()
+
+
+def sample():
+    """Take one sample and make it the cached one"""
+    global _stats
+    try:
+        rss, cpu_seconds, open_fds, threads = _read_proc()
+    except OSError:
+        rss, cpu_seconds, open_fds, threads = _read_rusage()
+
+    now = time.monotonic()
+    previous = _stats
+    cpu_percent = None
+    if previous:
+        elapsed = now - previous["_sampled_at"]
+        if elapsed > 0:
+            cpu_percent = round(100 * (cpu_seconds - previous["cpu_seconds"]) / elapsed, 1)
+
+    _stats = {
+        "memory_rss_bytes": rss,
+        "cpu_seconds": round(cpu_seconds, 2),
+        "cpu_percent": cpu_percent,
+        "open_fds": open_fds,
+        "threads": threads,
+        "sampled_at": int(time.time()),
+        "_sampled_at": now,
+    }
+
+
+def _sample_loop(interval):
+    while True:
+        try:
+            sample()
+        except Exception as e:
+            logger.error("Process stats sample failed", extra={"error": str(e)})
+        time.sleep(interval)
+
+
+def start_process_sampler(interval=PROCESS_STATS_INTERVAL):
+    """Sample in a daemon thread so requests only ever read the cached values"""
+    global _sampler
+    if _sampler is not None:
+        return
+    _sampler = threading.Thread(target=_sample_loop, args=(interval,), name="process-stats", daemon=True)
+    _sampler.start()
+
+
+def get_process_stats():
+    """Latest cached sample of this process (empty until the first one)"""
+    return {key: value for key, value in _stats.items() if not key.startswith("_")}
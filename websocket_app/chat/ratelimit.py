@@ -0,0 +1,98 @@
+import os
+import time
+from collections import OrderedDict
+from chat.metrics import inc_messages_throttled
+
+# Inbound message limits; a rate of 0 disables that scope
+RATE_LIMIT_SESSION_RATE = float(os.getenv('RATE_LIMIT_SESSION_RATE', '20'))  # messages/second per session
+RATE_LIMIT_SESSION_BURST = float(os.getenv('RATE_LIMIT_SESSION_BURST', '40'))
+RATE_LIMIT_IP_RATE = float(os.getenv('RATE_LIMIT_IP_RATE', '100'))  # messages/second per client IP
+RATE_LIMIT_IP_BURST = float(os.getenv('RATE_LIMIT_IP_BURST', '200'))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))  # buckets kept per scope
+RATE_LIMIT_POLICY = os.getenv('RATE_LIMIT_POLICY', 'reject')  # reject: drop and reply, close: disconnect
+
+# Close code for RATE_LIMIT_POLICY=close (private-use range)
+RATE_LIMIT_CLOSE_CODE = 4029
+
+RATE_LIMITED = {"error": "rate_limited"}
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets keyed by an arbitrary string.
+
+    Refill is computed lazily from the time since the bucket was last touched,
+    so ``allow()`` is O(1) with no timers. Buckets are kept in touch order; a
+    bucket untouched for ``burst / rate`` seconds is full again and therefore
+    indistinguishable from a new one, so those are dropped from the head as
+    other keys are checked. ``max_keys`` bounds memory under key churn.
+    """
+
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self.refill_time = self.burst / rate
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+
+    def allow(self, key, now=None):
+        """Take one token for ``key``; False if its bucket is empty"""
+        if now is None:
+            now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens = self.burst
+        else:
+            tokens, updated_at = bucket
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._evict(now)
+        return allowed
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            _, updated_at = next(iter(buckets.values()))
+            if now - updated_at < self.refill_time:
+                break
+            buckets.popitem(last=False)
+        while len(buckets) > self.max_keys:
+            buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Per process: with several workers each one enforces the limits on its own share
+session_limiter = TokenBucketLimiter(RATE_LIMIT_SESSION_RATE, RATE_LIMIT_SESSION_BURST) if RATE_LIMIT_SESSION_RATE > 0 else None
+ip_limiter = TokenBucketLimiter(RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST) if RATE_LIMIT_IP_RATE > 0 else None
+
+
+def client_ip(scope):
+    """Client address as forwarded by nginx in X-Real-IP, else the peer address"""
+    for name, value in scope.get("headers", ()):
+        if name == b"x-real-ip":
+            return value.decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else None
+
+
+def check_message(session_id, ip):
+    """
+    Charge one inbound message to its session and IP buckets.
+
+    Returns None if it may be processed, otherwise the scope that throttled it
+    ("session" or "ip").
+    """
+    now = time.monotonic()
+    if session_limiter is not None and not session_limiter.allow(session_id, now):
+        inc_messages_throttled("session")
+        return "session"
+    if ip_limiter is not None and ip is not None and not ip_limiter.allow(ip, now):
+        inc_messages_throttled("ip")
+        return "ip"
+    return None
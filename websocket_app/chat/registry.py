@@ -0,0 +1,150 @@
+"""
+Indexed registry of this worker's live connections.
+
+Besides the set of connections it keeps secondary indexes by session id, by
+client IP and by connect-time bucket, so lookups, counts and stats pages never
+scan every connection:
+
+- ``by_session()`` / ``by_ip()`` are dict lookups
+- ``page()`` walks connections in connect order from a cursor, skipping whole
+  age buckets that lie before it
+
+Every registered connection gets an increasing ``connection_id``, which is also
+the pagination cursor.
+"""
+import itertools
+import os
+import time
+
+DUPLICATE_SESSION_POLICY = os.getenv('DUPLICATE_SESSION_POLICY', 'kick_old')  # kick_old | reject_new | allow
+SESSION_REPLACED_CLOSE_CODE = 4009  # another connection took over the session
+KICKED_CLOSE_CODE = 4010  # closed through the /connections/ admin endpoint
+REGISTRY_AGE_BUCKET = float(os.getenv('REGISTRY_AGE_BUCKET', '60'))  # seconds of connect time per age bucket
+
+
+class ConnectionRegistry:
+
+    def __init__(self, age_bucket=REGISTRY_AGE_BUCKET):
+        self.age_bucket = age_bucket
+        self._ids = itertools.count(1)
+        self._entries = {}  # conn -> (connection_id, connected_at, age bucket)
+        # session_id / client ip -> the connection, or {conn: None} (oldest first) once
+        # a key has several: most have one, and a dict each would cost every connection
+        self._by_session = {}
+        self._by_ip = {}
+        self._by_age = {}  # age bucket -> {connection_id: conn}; buckets and members in connect order
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __contains__(self, conn):
+        return conn in self._entries
+
+    @staticmethod
+    def _index_add(index, key, conn):
+        members = index.get(key)
+        if members is None:
+            index[key] = conn
+        elif type(members) is dict:
+            members[conn] = None
+        else:
+            index[key] = {members: None, conn: None}
+
+    @staticmethod
+    def _index_discard(index, key, conn):
+        members = index.get(key)
+        if members is conn:
+            del index[key]
+        elif type(members) is dict:
+            members.pop(conn, None)
+            if len(members) == 1:
+                index[key] = next(iter(members))
+
+    @staticmethod
+    def _index_get(index, key):
+        members = index.get(key)
+        if members is None:
+            return []
+        if type(members) is dict:
+            return list(members)
+        return [members]
+
+    def add(self, conn):
+        """Register ``conn``; returns its connection id"""
+        if conn in self._entries:
+            return self._entries[conn][0]
+        connection_id = next(self._ids)
+        connected_at = time.monotonic()
+        bucket = int(connected_at // self.age_bucket)
+        self._entries[conn] = (connection_id, connected_at, bucket)
+        self._index_add(self._by_session, conn.session_id, conn)
+        self._index_add(self._by_ip, getattr(conn, 'client_ip', None), conn)
+        members = self._by_age.get(bucket)
+        if members is None:
+            members = self._by_age[bucket] = {}
+        members[connection_id] = conn
+        return connection_id
+
+    def discard(self, conn):
+        """Unregister ``conn``; safe to call more than once"""
+        entry = self._entries.pop(conn, None)
+        if entry is None:
+            return
+        connection_id, _, bucket = entry
+        self._index_discard(self._by_session, conn.session_id, conn)
+        self._index_discard(self._by_ip, getattr(conn, 'client_ip', None), conn)
+        members = self._by_age.get(bucket)
+        if members is not None:
+            members.pop(connection_id, None)
+            if not members:
+                del self._by_age[bucket]
+
+    def by_session(self, session_id):
+        """Connections of one session, oldest first"""
+        return self._index_get(self._by_session, session_id)
+
+    def by_ip(self, ip):
+        return self._index_get(self._by_ip, ip)
+
+    def counts(self):
+        return {
+            "connections": len(self._entries),
+            "sessions": len(self._by_session),
+            "client_ips": len(self._by_ip),
+        }
+
+    def connection_id(self, conn):
+        entry = self._entries.get(conn)
+        return entry[0] if entry is not None else None
+
+    def connected_at(self, conn):
+        entry = self._entries.get(conn)
+        return entry[1] if entry is not None else None
+
+    def page(self, after=0, limit=100):
+        """
+        Up to ``limit`` connections with a connection id above ``after``, in
+        connect order. Returns ``(connections, next_cursor)``; the cursor is
+        None on the last page.
+
+        Buckets entirely before the cursor are skipped whole, but the bucket
+        holding it is scanned from its start, so a page costs
+        O(buckets + cursor bucket size + limit).
+        """
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        connections = []
+        for members in self._by_age.values():
+            # Buckets hold increasing ids, so the last one says if any is past the cursor
+            if next(reversed(members)) <= after:
+                continue
+            for connection_id, conn in members.items():
+                if connection_id <= after:
+                    continue
+                if len(connections) == limit:
+                    return connections, self._entries[connections[-1]][0]
+                connections.append(conn)
+        return connections, None
@@ -0,0 +1,223 @@
+"""
+Bounded per-session log of outbound frames, replayed when a session resumes.
+
+Connections that opt in (``?replay=1``) get a ``"seq"`` field spliced into every
+frame sent after the connect frame. The seq'd frame is kept in a ring per session,
+next to its count in the session store. A client reconnecting with the last seq
+it processed (``?last_seq=N`` or an ``X-Last-Seq`` header) is sent the frames after
+it, so nothing written while it was between sockets is lost.
+
+While a session is disconnected it keeps receiving broadcasts for up to
+REPLAY_TTL seconds. Those are stored once, in a log shared by every disconnected
+session; each ring only remembers where in the log it was detached, and the
+frames it missed are seq'd into it when it resumes. Like TTLSessionStore the
+rings are process-local, so replay needs the reconnect to land on the same
+worker. Memory is bounded twice: at most REPLAY_MAX_FRAMES per session (and in
+the log), and REPLAY_MAX_BYTES in total, over which the least recently written
+sessions lose their whole ring. A client whose first
+replayed seq is not ``last_seq + 1`` has fallen out of the window and must
+resync.
+"""
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from chat.metrics import set_replay_buffer_bytes
+
+logger = logging.getLogger(__name__)
+
+REPLAY_MAX_FRAMES = int(os.getenv('REPLAY_MAX_FRAMES', '256'))  # frames kept per session
+REPLAY_MAX_BYTES = int(os.getenv('REPLAY_MAX_BYTES', str(64 * 1024 * 1024)))  # all sessions; 0 disables replay
+REPLAY_TTL = float(os.getenv('REPLAY_TTL', os.getenv('SESSION_TTL', '300')))  # seconds a disconnected session keeps recording
+
+
+class ReplayRing:
+    __slots__ = ("codec", "frames", "bytes", "last_seq", "written_at", "detached_at", "log_from")
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.frames = deque()  # (seq, frame), oldest first
+        self.bytes = 0
+        self.last_seq = 0
+        self.written_at = 0.0
+        self.detached_at = None
+        self.log_from = None  # position of the next broadcast when detached
+
+
+class ReplayStore:
+    """
+    Rings keyed by session id, in an OrderedDict kept in last-write order so the
+    byte cap always evicts from the head, like TTLSessionStore's capacity limit.
+    """
+
+    def __init__(self, max_frames=REPLAY_MAX_FRAMES, max_bytes=REPLAY_MAX_BYTES, ttl=REPLAY_TTL):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.rings = OrderedDict()
+        self.detached = set()
+        self.bytes = 0
+        # Broadcasts sent while any session is detached, stored once for all of them:
+        # (position, sent_at, frames by codec name, bytes), oldest first
+        self.log = deque()
+        self.broadcasts = 0  # position of the next broadcast
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def append(self, session_id, codec, seq, frame):
+        """Keep ``frame`` (already carrying ``seq``) for the session"""
+        ring = self.rings.pop(session_id, None)
+        if ring is None:
+            ring = ReplayRing(codec)
+        self.rings[session_id] = ring
+
+        size = len(frame)
+        ring.frames.append((seq, frame))
+        ring.bytes += size
+        ring.last_seq = seq
+        ring.written_at = time.monotonic()
+        self.bytes += size
+
+        while len(ring.frames) > self.max_frames:
+            _, dropped = ring.frames.popleft()
+            ring.bytes -= len(dropped)
+            self.bytes -= len(dropped)
+
+        while self.bytes > self.max_bytes and self.rings:
+            self._drop(next(iter(self.rings)))
+        set_replay_buffer_bytes(self.bytes)
+
+    def _drop(self, session_id):
+        ring = self.rings.pop(session_id, None)
+        if ring is not None:
+            self.bytes -= ring.bytes
+        self.detached.discard(session_id)
+
+    def since(self, session_id, last_seq):
+        """Frames after ``last_seq``, oldest first"""
+        ring = self.rings.get(session_id)
+        if ring is None:
+            return []
+        return [frame for seq, frame in ring.frames if seq > last_seq]
+
+    def attach(self, session_id, codec):
+        """
+        The session has a live connection again and records its own frames.
+        Returns the last seq kept for it; a ring in another codec is dropped,
+        since its frames could not be replayed.
+        """
+        ring = self.rings.get(session_id)
+        if ring is None:
+            self.detached.discard(session_id)
+            return 0
+        if session_id in self.detached:
+            self.detached.discard(session_id)
+            self._catch_up(session_id, ring, encode=ring.codec is codec)
+        if ring.codec is not codec:
+            self._drop(session_id)
+            set_replay_buffer_bytes(self.bytes)
+            return ring.last_seq
+        ring.detached_at = None
+        return ring.last_seq
+
+    def _catch_up(self, session_id, ring, encode=True):
+        """Seq the broadcasts logged since the ring was detached into it"""
+        # The broadcast at log position p gets seq base + p + 1
+        base = ring.last_seq - ring.log_from
+        if encode:
+            codec = ring.codec
+            for position, _, frames, _ in self.log:
+                if position >= ring.log_from:
+                    seq = base + position + 1
+                    self.append(session_id, codec, seq, codec.add_seq(frames[codec.name], seq))
+        # Broadcasts already trimmed from the log still take their seq, so the
+        # client sees the gap and knows to resync
+        ring.last_seq = base + self.broadcasts
+        ring.log_from = None
+
+    def detach(self, session_id, codec, last_seq):
+        """The session's connection closed; keep recording broadcasts for it"""
+        ring = self.rings.pop(session_id, None)
+        if ring is None:
+            ring = ReplayRing(codec)
+            ring.last_seq = last_seq
+        self.rings[session_id] = ring
+        ring.written_at = ring.detached_at = time.monotonic()
+        ring.log_from = self.broadcasts
+        self.detached.add(session_id)
+        self.expire()
+
+    def record_broadcast(self, frames):
+        """
+        Log a broadcast (encoded per codec name) for every disconnected session.
+        O(1) however many there are: nothing is copied per session until it resumes.
+        """
+        if not self.detached:
+            return
+        now = time.monotonic()
+        size = sum(len(frame) for frame in frames.values())
+        self.log.append((self.broadcasts, now, frames, size))
+        self.broadcasts += 1
+        self.bytes += size
+        self._trim_log(now)
+        while self.bytes > self.max_bytes and self.rings:
+            self._drop(next(iter(self.rings)))
+        self._trim_log(now)
+        set_replay_buffer_bytes(self.bytes)
+
+    def _trim_log(self, now):
+        # Sessions detached more than REPLAY_TTL ago have expired, so nothing that
+        # old is still needed; nor is anything past what one ring could keep
+        cutoff = now - self.ttl
+        log = self.log
+        while log and (not self.detached or len(log) > self.max_frames or log[0][1] < cutoff):
+            self.bytes -= log.popleft()[3]
+
+    def expire(self):
+        """Drop rings of sessions that stopped writing more than REPLAY_TTL ago"""
+        now = time.monotonic()
+        cutoff = now - self.ttl
+        while self.rings:
+            session_id, ring = next(iter(self.rings.items()))
+            if ring.written_at > cutoff:
+                break
+            self._drop(session_id)
+        self._trim_log(now)
+        set_replay_buffer_bytes(self.bytes)
+
+
+replay_store = ReplayStore()
+
+
+def requested_seq(query, headers):
+    """The last seq a resuming client processed, from ``?last_seq=`` or X-Last-Seq"""
+    value = query.get("last_seq", [None])[0] or headers.get(b"x-last-seq", b"").decode()
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+async def record_broadcasts():
+    """
+    Subscribe this process to the broadcast group on behalf of disconnected
+    sessions, so broadcasts sent while they are away can be replayed.
+    """
+    from channels.layers import get_channel_layer
+    from chat.broadcast import BROADCAST_GROUP
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not replay_store.enabled:
+        return
+    channel = await channel_layer.new_channel("replay")
+    await channel_layer.group_add(BROADCAST_GROUP, channel)
+    while True:
+        try:
+            message = await channel_layer.receive(channel)
+            if message.get("type") == "chat.broadcast":
+                replay_store.record_broadcast(message["frames"])
+            replay_store.expire()
+        except Exception as e:
+            logger.error("Replay recording failed", extra={"error": str(e)})
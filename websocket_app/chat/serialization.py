@@ -0,0 +1,58 @@
+"""
+Serializer layer for every frame the server builds.
+
+Picks the fastest JSON backend available (orjson, then msgspec, then the stdlib)
+and provides cached templates for the fixed-shape replies sent on every message,
+so the hot path formats a string instead of building a dict and encoding it.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    loads = orjson.loads
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    _encoder = msgspec.json.Encoder()
+
+    def dumps(obj):
+        return _encoder.encode(obj).decode()
+
+    loads = msgspec.json.Decoder().decode
+else:
+    BACKEND = "json"
+    dumps = json.JSONEncoder(separators=(",", ":")).encode
+    loads = json.loads
+
+
+# Fixed-shape frames
+_COUNT_FRAME = '{"count":%d}'
+_BYE_FRAME = '{"bye":true,"total":%d}'
+_CONNECT_FRAME = '{"session_id":%s,"resumed":%s,"count":%d}'
+
+
+def count_frame(count):
+    return _COUNT_FRAME % count
+
+
+def bye_frame(total):
+    return _BYE_FRAME % total
+
+
+def connect_frame(session_id, resumed, count):
+    # session_id comes from a client header, so it still goes through the encoder
+    return _CONNECT_FRAME % (dumps(session_id), "true" if resumed else "false", count)
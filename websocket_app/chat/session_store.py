@@ -1,23 +1,328 @@
+import asyncio
+import atexit
+from abc import ABC, abstractmethod
+import json
+import logging
+import os
+import sqlite3
+import threading
 import time
 from collections import OrderedDict
+from chat.metrics import inc_session_store_evictions, set_session_store_entries
 
-class TTLSessionStore:
-    def __init__(self, ttl_seconds=300):
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(ABC):
+    """
+    Interface for session state backends.
+
+    ``get``/``set``/``delete`` never block on the network or disk for writes;
+    ``aget`` is what the connect path awaits, so backends that may need to read
+    from disk can do it off the event loop.
+    """
+
+    @abstractmethod
+    def get(self, session_id):
+        """The saved state of ``session_id``, or None"""
+
+    @abstractmethod
+    def set(self, session_id, data):
+        """Save ``data`` for ``session_id``"""
+
+    @abstractmethod
+    def delete(self, session_id):
+        """Forget ``session_id``"""
+
+    async def aget(self, session_id):
+        return self.get(session_id)
+
+    def flush(self):
+        """Persist any buffered writes"""
+
+    def close(self):
+        self.flush()
+
+
+class TTLSessionStore(SessionStore):
+    """
+    Process-local store; sessions are lost on restart or when hopping workers.
+
+    ``set()`` re-inserts the key at the tail, so the OrderedDict stays sorted by
+    save time. Expired entries are therefore always at the head and are popped
+    incrementally on every write, amortized O(1). Once ``max_entries`` is reached
+    the least recently saved session is evicted.
+    """
+
+    def __init__(self, ttl_seconds=300, max_entries=100000):
         self.ttl = ttl_seconds
+        self.max_entries = max_entries
         self.sessions = OrderedDict()
 
+    def _expire(self, now):
+        expired = 0
+        while self.sessions:
+            created_at, _ = next(iter(self.sessions.values()))
+            if now - created_at <= self.ttl:
+                break
+            self.sessions.popitem(last=False)
+            expired += 1
+        if expired:
+            inc_session_store_evictions("expired", expired)
+
     def set(self, session_id, data):
-        self.sessions[session_id] = (time.time(), data)
+        now = time.monotonic()
+        self.sessions.pop(session_id, None)
+        self.sessions[session_id] = (now, data)
+        self._expire(now)
+
+        evicted = 0
+        while len(self.sessions) > self.max_entries:
+            self.sessions.popitem(last=False)
+            evicted += 1
+        if evicted:
+            inc_session_store_evictions("capacity", evicted)
+        set_session_store_entries(len(self.sessions))
 
     def get(self, session_id):
         entry = self.sessions.get(session_id)
         if not entry:
             return None
         created_at, data = entry
-        if time.time() - created_at > self.ttl:
+        if time.monotonic() - created_at > self.ttl:
             del self.sessions[session_id]
+            inc_session_store_evictions("expired")
+            set_session_store_entries(len(self.sessions))
             return None
         return data
 
     def delete(self, session_id):
         self.sessions.pop(session_id, None)
+        set_session_store_entries(len(self.sessions))
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store shared by every process that opens the same SQLite file.
+
+    Writes go to an in-memory pending batch and are committed by a background
+    thread every ``flush_interval`` seconds (or sooner once ``batch_size`` writes
+    are queued), so ``disconnect()`` never waits on disk. Misses in the bounded
+    per-process LRU fall through to SQLite on an executor thread.
+
+    The LRU is per process, so a session that moved to another worker and back
+    may be cached here with stale state. ``aget()``, the connect path, therefore
+    checks a cached entry against ``updated_at`` in SQLite (a primary key lookup
+    on the executor) and only uses it if no newer save exists. ``get()`` trusts
+    the LRU for up to ``cache_ttl`` seconds. Saves still sitting in another
+    worker's pending batch (up to ``flush_interval``) are not visible either way.
+    """
+
+    PURGE_INTERVAL = 60
+
+    def __init__(self, path, ttl_seconds=300, cache_size=10000, cache_ttl=30,
+                 flush_interval=1.0, batch_size=500):
+        self.path = str(path)
+        self.ttl = ttl_seconds
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._cache = OrderedDict()  # session_id -> (cached_at, updated_at, data)
+        self._pending = {}  # session_id -> (updated_at, data); data None means delete
+        self._lock = threading.Lock()  # guards _cache and _pending
+        self._db_lock = threading.Lock()  # serializes use of the shared connection
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._last_purge = time.time()
+
+        self._db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="session-store-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    # Cache helpers (caller holds self._lock)
+
+    def _cache_put(self, session_id, updated_at, data):
+        self._cache[session_id] = (time.time(), updated_at, data)
+        self._cache.move_to_end(session_id)
+        evicted = 0
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+            evicted += 1
+        if evicted:
+            inc_session_store_evictions("capacity", evicted)
+        set_session_store_entries(len(self._cache))
+
+    def _lookup(self, session_id):
+        """Return (found, updated_at, data) from pending writes or the LRU"""
+        now = time.time()
+        pending = self._pending.get(session_id)
+        if pending is not None:
+            updated_at, data = pending
+            if data is None or now - updated_at > self.ttl:
+                return True, updated_at, None
+            return True, updated_at, data
+
+        entry = self._cache.get(session_id)
+        if entry is None:
+            return False, None, None
+        cached_at, updated_at, data = entry
+        if now - cached_at > self.cache_ttl:
+            self._cache_expire(session_id)
+            return False, None, None
+        if now - updated_at > self.ttl:
+            self._cache_expire(session_id)
+            return True, updated_at, None
+        self._cache.move_to_end(session_id)
+        return True, updated_at, data
+
+    def _cache_expire(self, session_id):
+        del self._cache[session_id]
+        inc_session_store_evictions("expired")
+        set_session_store_entries(len(self._cache))
+
+    # Public API
+
+    def set(self, session_id, data):
+        now = time.time()
+        with self._lock:
+            self._pending[session_id] = (now, data)
+            self._cache_put(session_id, now, data)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._pending[session_id] = (time.time(), None)
+            if self._cache.pop(session_id, None) is not None:
+                set_session_store_entries(len(self._cache))
+
+    def get(self, session_id):
+        with self._lock:
+            found, _, data = self._lookup(session_id)
+        if found:
+            return data
+        return self._read_through(session_id)
+
+    async def aget(self, session_id):
+        with self._lock:
+            found, updated_at, data = self._lookup(session_id)
+        local = (updated_at, data) if found else None
+        # Even on a hit: another worker may have saved the session since
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._read_through, session_id, local)
+
+    def _read_through(self, session_id, local=None):
+        """
+        Read a session from SQLite. ``local`` is an ``(updated_at, data)`` held by
+        this process; it is returned unless SQLite has a newer save.
+        """
+        since = time.time() - self.ttl
+        if local is not None:
+            since = max(since, local[0])
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT data, updated_at FROM sessions WHERE session_id = ? AND updated_at > ?",
+                (session_id, since)
+            ).fetchone()
+        if row is None:
+            return local[1] if local is not None else None
+        data = json.loads(row[0])
+        with self._lock:
+            # A local write may have landed while we were reading; it wins
+            if session_id not in self._pending:
+                self._cache_put(session_id, row[1], data)
+        return data
+
+    # Write-behind
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                batch = None
+            else:
+                batch, self._pending = self._pending, {}
+
+        now = time.time()
+        purge = now - self._last_purge >= self.PURGE_INTERVAL
+        if batch is None and not purge:
+            return
+
+        upserts = [
+            (session_id, json.dumps(data), updated_at)
+            for session_id, (updated_at, data) in (batch or {}).items()
+            if data is not None
+        ]
+        deletes = [(session_id,) for session_id, (_, data) in (batch or {}).items() if data is None]
+
+        try:
+            with self._db_lock:
+                self._db.execute("BEGIN")
+                if upserts:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                        upserts
+                    )
+                if deletes:
+                    self._db.executemany("DELETE FROM sessions WHERE session_id = ?", deletes)
+                if purge:
+                    self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+                self._db.execute("COMMIT")
+            if purge:
+                self._last_purge = now
+        except sqlite3.Error as e:
+            logger.error("Session store flush failed", extra={"error": str(e), "batch_size": len(batch or {})})
+            with self._db_lock:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+            if batch:
+                # Put the batch back unless newer writes superseded it
+                with self._lock:
+                    for session_id, entry in batch.items():
+                        self._pending.setdefault(session_id, entry)
+
+    def _flush_loop(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wakeup.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+
+
+def create_session_store():
+    """Build the session store selected by SESSION_STORE_BACKEND"""
+    backend = os.getenv('SESSION_STORE_BACKEND', 'memory')
+    ttl = float(os.getenv('SESSION_TTL', '300'))
+
+    if backend == 'memory':
+        return TTLSessionStore(
+            ttl_seconds=ttl,
+            max_entries=int(os.getenv('SESSION_MAX_ENTRIES', '100000')),
+        )
+    if backend == 'sqlite':
+        return SQLiteSessionStore(
+            os.getenv('SESSION_STORE_PATH', 'sessions.sqlite3'),
+            ttl_seconds=ttl,
+            cache_size=int(os.getenv('SESSION_CACHE_SIZE', '10000')),
+            cache_ttl=float(os.getenv('SESSION_CACHE_TTL', '30')),
+            flush_interval=float(os.getenv('SESSION_FLUSH_INTERVAL', '1')),
+            batch_size=int(os.getenv('SESSION_FLUSH_BATCH_SIZE', '500')),
+        )
+    raise ValueError(f"Unknown SESSION_STORE_BACKEND: {backend!r}")
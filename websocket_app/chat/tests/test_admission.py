@@ -0,0 +1,64 @@
+import asyncio
+from functools import partial
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from chat.admission import OVERLOADED_CLOSE_CODE
+from chat.connection_pool import registry
+from chat.outbound import OutboundBuffer
+from chat.tests.websocket import WebsocketCommunicator, application, in_memory_channel_layer
+
+
+@in_memory_channel_layer
+class AdmissionTests(SimpleTestCase):
+
+    async def test_overloaded_worker_refuses_handshakes_and_is_not_ready(self):
+        first = WebsocketCommunicator(application, "/ws/chat/")
+        with mock.patch("chat.admission.ADMISSION_MAX_CONNECTIONS", len(registry) + 1):
+            await first.connect()
+            await first.receive_from()
+
+            refused = WebsocketCommunicator(application, "/ws/chat/")
+            # Accepted first, so the client sees why it was refused
+            self.assertEqual(await refused.connect(), (True, None))
+            self.assertEqual(await refused.receive_close(), OVERLOADED_CLOSE_CODE)
+            await refused.wait()
+
+            with self.assertLogs("django.request", level="ERROR"):
+                response = await self.async_client.get("/ready/")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()["reason"], "connections")
+
+            # Existing connections carry on
+            await first.send_to(text_data="m")
+            self.assertEqual(await first.receive_json_from(), {"count": 1})
+        await first.disconnect()
+
+        response = await self.async_client.get("/ready/")
+        self.assertEqual(response.status_code, 200)
+
+    async def test_backpressure_wait_is_not_message_latency(self):
+        async def slow_client(scope, receive, send):
+            async def slow_send(message):
+                if message["type"] == "websocket.send":
+                    await asyncio.sleep(0.2)
+                await send(message)
+            await application(scope, receive, slow_send)
+
+        # Every reply fills the buffer, so receive() waits until the client has read it
+        with mock.patch("chat.consumers.OutboundBuffer", partial(OutboundBuffer, high_watermark=1, low_watermark=0)), \
+                mock.patch("chat.consumers.observe_message_latency") as observe, \
+                mock.patch("chat.consumers.record_message_processing_time") as record:
+            communicator = WebsocketCommunicator(slow_client, "/ws/chat/")
+            await communicator.connect()
+            await communicator.receive_from(timeout=2)
+            await communicator.send_to(text_data="m")
+            await communicator.send_to(text_data="m")
+            await communicator.receive_from(timeout=2)
+            await communicator.receive_from(timeout=2)
+            await communicator.disconnect()
+
+        self.assertEqual(observe.call_count, 2)
+        self.assertGreaterEqual(max(call.args[0] for call in record.call_args_list), 0.15)
+        self.assertLess(max(call.args[0] for call in observe.call_args_list), 0.1)
@@ -0,0 +1,54 @@
+import asyncio
+import tempfile
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase
+
+from chat.channel_layer import LocalProcessChannelLayer, MessageTooLarge
+
+
+class LocalProcessChannelLayerTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.socket_dir = directory.name
+
+    async def open_layer(self):
+        layer = LocalProcessChannelLayer(socket_dir=self.socket_dir)
+        self.addCleanup(async_to_sync(layer.close))
+        return layer
+
+    async def test_group_send_reaches_local_and_peer_members(self):
+        sender, peer = await self.open_layer(), await self.open_layer()
+        local_channel = await sender.new_channel()
+        peer_channel = await peer.new_channel()
+        await sender.group_add("g", local_channel)
+        await peer.group_add("g", peer_channel)
+
+        await sender.group_send("g", {"type": "x", "data": b"\x00\x01"})
+        self.assertEqual(await asyncio.wait_for(sender.receive(local_channel), 1), {"type": "x", "data": b"\x00\x01"})
+        self.assertEqual(await asyncio.wait_for(peer.receive(peer_channel), 1), {"type": "x", "data": b"\x00\x01"})
+
+    async def test_message_too_large_for_a_datagram_reaches_nobody(self):
+        sender, peer = await self.open_layer(), await self.open_layer()
+        local_channel = await sender.new_channel()
+        await sender.group_add("g", local_channel)
+        await peer.group_add("g", await peer.new_channel())
+
+        with self.assertRaises(MessageTooLarge):
+            await sender.group_send("g", {"type": "x", "data": "y" * sender.MAX_DATAGRAM_SIZE})
+        self.assertEqual(len(sender._channels[local_channel]), 0)
+
+    async def test_flush_wakes_pending_receive(self):
+        layer = await self.open_layer()
+        channel = await layer.new_channel()
+        receive = asyncio.ensure_future(layer.receive(channel))
+        await asyncio.sleep(0.01)
+
+        await layer.flush()
+        await asyncio.sleep(0.01)
+        self.assertFalse(receive.done())
+        # Still receiving, now from the fresh mailbox
+        await layer.send(channel, {"type": "after"})
+        self.assertEqual(await asyncio.wait_for(receive, 1), {"type": "after"})
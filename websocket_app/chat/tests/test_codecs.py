@@ -0,0 +1,133 @@
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from chat.codecs import CBORCodec, JSON_CODEC, MsgPackCodec, cbor2, msgpack, negotiate
+from chat.tests.websocket import WebsocketCommunicator, application, in_memory_channel_layer
+
+
+class NegotiateTests(SimpleTestCase):
+
+    def test_json_when_nothing_supported_is_offered(self):
+        self.assertEqual(negotiate(None), (JSON_CODEC, None))
+        self.assertEqual(negotiate(["x-unknown"]), (JSON_CODEC, None))
+
+    @skipUnless(msgpack, "msgpack is not installed")
+    def test_first_supported_subprotocol_wins(self):
+        codec, subprotocol = negotiate(["x-unknown", "msgpack", "json"])
+        self.assertEqual((codec.name, subprotocol), ("msgpack", "msgpack"))
+        self.assertEqual(negotiate(["json", "msgpack"]), (JSON_CODEC, "json"))
+
+
+class JSONCodecTests(SimpleTestCase):
+
+    def test_fixed_frames(self):
+        self.assertEqual(JSON_CODEC.count_frame(3), '{"count":3}')
+        self.assertEqual(JSON_CODEC.bye_frame(3), '{"bye":true,"total":3}')
+        self.assertEqual(
+            JSON_CODEC.decode(JSON_CODEC.connect_frame('a"b', True, 3)),
+            {"session_id": 'a"b', "resumed": True, "count": 3}
+        )
+
+    def test_join_frames(self):
+        self.assertEqual(JSON_CODEC.join_frames(['{"a":1}', '{"b":2}']), '[{"a":1},{"b":2}]')
+
+    def test_add_seq(self):
+        self.assertEqual(JSON_CODEC.add_seq('{"count":1}', 7), '{"seq":7,"count":1}')
+        self.assertEqual(JSON_CODEC.add_seq('{}', 7), '{"seq":7}')
+        self.assertEqual(JSON_CODEC.add_seq('[1,2]', 7), '[1,2]')
+
+
+@skipUnless(msgpack, "msgpack is not installed")
+class MsgPackCodecTests(SimpleTestCase):
+
+    def setUp(self):
+        self.codec = MsgPackCodec()
+
+    def test_fixed_frames_match_the_encoder(self):
+        # Pre-encoded headers followed by ints of every msgpack width
+        for value in (0, 127, 128, 0xffff, 0x10000, 2 ** 40):
+            self.assertEqual(msgpack.unpackb(self.codec.count_frame(value)), {"count": value})
+            self.assertEqual(msgpack.unpackb(self.codec.bye_frame(value)), {"bye": True, "total": value})
+        self.assertEqual(
+            msgpack.unpackb(self.codec.connect_frame("s", False, 2)),
+            {"session_id": "s", "resumed": False, "count": 2}
+        )
+
+    def test_join_frames_across_array_headers(self):
+        # fixarray -> array16 -> array32
+        for count in (0, 15, 16, 0xffff, 0x10000):
+            frames = [self.codec.count_frame(i) for i in range(count)]
+            joined = msgpack.unpackb(self.codec.join_frames(frames))
+            self.assertEqual(len(joined), count)
+            if count:
+                self.assertEqual(joined[-1], {"count": count - 1})
+
+    def test_add_seq_across_map_headers(self):
+        # fixmap -> fixmap, fixmap -> map16, map16 -> map32
+        for size in (0, 14, 15, 0xffff):
+            frame = msgpack.packb({f"k{i}": i for i in range(size)})
+            decoded = msgpack.unpackb(self.codec.add_seq(frame, 42))
+            self.assertEqual(len(decoded), size + 1)
+            self.assertEqual(decoded["seq"], 42)
+            self.assertEqual(list(decoded)[0], "seq")
+
+    def test_add_seq_leaves_non_maps(self):
+        frame = msgpack.packb([1, 2])
+        self.assertEqual(self.codec.add_seq(frame, 1), frame)
+
+
+@skipUnless(cbor2, "cbor2 is not installed")
+class CBORCodecTests(SimpleTestCase):
+
+    def setUp(self):
+        self.codec = CBORCodec()
+
+    def test_fixed_frames_match_the_encoder(self):
+        for value in (0, 23, 24, 0xffff, 0x10000, 2 ** 40):
+            self.assertEqual(cbor2.loads(self.codec.count_frame(value)), {"count": value})
+            self.assertEqual(cbor2.loads(self.codec.bye_frame(value)), {"bye": True, "total": value})
+        self.assertEqual(
+            cbor2.loads(self.codec.connect_frame("s", False, 2)),
+            {"session_id": "s", "resumed": False, "count": 2}
+        )
+
+    def test_join_frames_across_array_headers(self):
+        for count in (23, 24, 0xff, 0x100, 0xffff, 0x10000):
+            frames = [cbor2.dumps(i) for i in range(count)]
+            self.assertEqual(cbor2.loads(self.codec.join_frames(frames)), list(range(count)))
+
+    def test_add_seq_across_map_headers(self):
+        # inline length -> 1, 2 and 4 byte lengths
+        for size in (0, 22, 23, 0xff, 0xffff):
+            frame = cbor2.dumps({f"k{i}": i for i in range(size)})
+            decoded = cbor2.loads(self.codec.add_seq(frame, 42))
+            self.assertEqual(len(decoded), size + 1)
+            self.assertEqual(decoded["seq"], 42)
+
+    def test_add_seq_leaves_non_maps(self):
+        frame = cbor2.dumps([1, 2])
+        self.assertEqual(self.codec.add_seq(frame, 1), frame)
+
+
+@in_memory_channel_layer
+class CodecNegotiationConsumerTests(SimpleTestCase):
+
+    @skipUnless(msgpack, "msgpack is not installed")
+    async def test_msgpack_session(self):
+        communicator = WebsocketCommunicator(application, "/ws/chat/", subprotocols=["msgpack", "json"])
+        self.assertEqual(await communicator.connect(), (True, "msgpack"))
+        self.assertFalse(msgpack.unpackb(await communicator.receive_from())["resumed"])
+
+        await communicator.send_to(bytes_data=msgpack.packb({"text": "hi"}))
+        self.assertEqual(msgpack.unpackb(await communicator.receive_from()), {"count": 1})
+        await communicator.disconnect()
+
+    async def test_json_without_subprotocol(self):
+        communicator = WebsocketCommunicator(application, "/ws/chat/")
+        self.assertEqual(await communicator.connect(), (True, None))
+        self.assertEqual((await communicator.receive_json_from())["count"], 0)
+
+        await communicator.send_to(text_data="hello")
+        self.assertEqual(await communicator.receive_json_from(), {"count": 1})
+        await communicator.disconnect()
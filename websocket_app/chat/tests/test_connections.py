@@ -0,0 +1,107 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from chat.connection_pool import registry
+from chat.registry import KICKED_CLOSE_CODE, SESSION_REPLACED_CLOSE_CODE
+from chat.tests.websocket import WebsocketCommunicator, application, in_memory_channel_layer
+
+ADMIN = {"headers": {"X-Admin-Token": "secret"}}
+
+
+async def connect(session_id):
+    communicator = WebsocketCommunicator(application, "/ws/chat/", headers=[(b"x-session-id", session_id.encode())])
+    await communicator.connect()
+    return communicator, await communicator.receive_json_from()
+
+
+@in_memory_channel_layer
+class DuplicateSessionTests(SimpleTestCase):
+
+    @mock.patch("chat.consumers.DUPLICATE_SESSION_POLICY", "kick_old")
+    async def test_new_connection_takes_the_session_over(self):
+        old, _ = await connect("dup-kick")
+        await old.send_to(text_data="m")
+        await old.send_to(text_data="m")
+        await old.receive_from()
+        await old.receive_from()
+
+        with self.assertLogs(level="WARNING"):
+            new, session = await connect("dup-kick")
+        self.assertEqual(await old.receive_close(), SESSION_REPLACED_CLOSE_CODE)
+        # The old connection saved its count before the new one read it
+        self.assertEqual(session, {"session_id": "dup-kick", "resumed": True, "count": 2})
+        self.assertEqual([conn.count for conn in registry.by_session("dup-kick")], [2])
+
+        await old.disconnect()
+        self.assertEqual(len(registry.by_session("dup-kick")), 1)
+        await new.disconnect()
+
+    @mock.patch("chat.consumers.DUPLICATE_SESSION_POLICY", "reject_new")
+    async def test_reject_new_keeps_the_old_connection(self):
+        old, _ = await connect("dup-reject")
+        new = WebsocketCommunicator(application, "/ws/chat/", headers=[(b"x-session-id", b"dup-reject")])
+        await new.connect()
+        self.assertEqual(await new.receive_close(), SESSION_REPLACED_CLOSE_CODE)
+        await new.disconnect()
+
+        await old.send_to(text_data="m")
+        self.assertEqual(await old.receive_json_from(), {"count": 1})
+        await old.disconnect()
+
+
+@in_memory_channel_layer
+@mock.patch("chat.views.CONNECTIONS_ADMIN_TOKEN", "secret")
+class ConnectionsViewTests(SimpleTestCase):
+
+    async def test_requires_the_admin_token(self):
+        with self.assertLogs("django.request", level="WARNING"):
+            for headers in ({}, {"headers": {"X-Admin-Token": "wrong"}}):
+                response = await self.async_client.get("/connections/", **headers)
+                self.assertEqual(response.status_code, 403)
+                response = await self.async_client.post("/connections/kick/?session_id=s", **headers)
+                self.assertEqual(response.status_code, 403)
+
+            # Unset, the endpoints are closed rather than open to anyone
+            with mock.patch("chat.views.CONNECTIONS_ADMIN_TOKEN", ""):
+                response = await self.async_client.get("/connections/", headers={"X-Admin-Token": ""})
+                self.assertEqual(response.status_code, 403)
+
+    async def test_pages_in_connect_order(self):
+        clients = [(await connect(f"page-{i}"))[0] for i in range(3)]
+
+        response = await self.async_client.get("/connections/?limit=2", **ADMIN)
+        page = response.json()
+        self.assertEqual(page["counts"], {"connections": 3, "sessions": 3, "client_ips": 1})
+        self.assertEqual([conn["session_id"] for conn in page["connections"]], ["page-0", "page-1"])
+
+        response = await self.async_client.get(f"/connections/?limit=2&after={page['next']}", **ADMIN)
+        page = response.json()
+        self.assertEqual([conn["session_id"] for conn in page["connections"]], ["page-2"])
+        self.assertIsNone(page["next"])
+
+        response = await self.async_client.get("/connections/?session_id=page-1", **ADMIN)
+        self.assertEqual([conn["session_id"] for conn in response.json()["connections"]], ["page-1"])
+
+        with self.assertLogs("django.request", level="WARNING"):
+            for limit in ("0", "1001", "x"):
+                response = await self.async_client.get(f"/connections/?limit={limit}", **ADMIN)
+                self.assertEqual(response.status_code, 400)
+
+        for client in clients:
+            await client.disconnect()
+
+    async def test_kick_closes_the_session_which_stays_resumable(self):
+        communicator, _ = await connect("kicked")
+        await communicator.send_to(text_data="m")
+        await communicator.receive_from()
+
+        with self.assertLogs(level="WARNING"):
+            response = await self.async_client.post("/connections/kick/?session_id=kicked", **ADMIN)
+        self.assertEqual(response.json(), {"session_id": "kicked", "kicked": 1})
+        self.assertEqual(await communicator.receive_close(), KICKED_CLOSE_CODE)
+        await communicator.disconnect()
+
+        communicator, session = await connect("kicked")
+        self.assertEqual(session, {"session_id": "kicked", "resumed": True, "count": 1})
+        await communicator.disconnect()
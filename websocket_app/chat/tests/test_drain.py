@@ -0,0 +1,43 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from chat.admission import OVERLOADED_CLOSE_CODE
+from chat.consumers import session_store
+from chat.drain import drain_connections
+from chat.tests.websocket import WebsocketCommunicator, application, in_memory_channel_layer
+
+
+@in_memory_channel_layer
+@mock.patch("chat.drain._drain", None)
+@mock.patch("chat.admission.draining", False)
+class DrainTests(SimpleTestCase):
+
+    async def connect(self, session_id):
+        communicator = WebsocketCommunicator(application, "/ws/chat/", headers=[(b"x-session-id", session_id.encode())])
+        await communicator.connect()
+        await communicator.receive_from()
+        await communicator.send_to(text_data="m")
+        await communicator.receive_from()
+        return communicator
+
+    async def test_clients_get_one_bye_and_1001(self):
+        clients = [await self.connect(f"drain-{i}") for i in range(3)]
+
+        await drain_connections(timeout=2)
+        # A second drain (the lifespan shutdown after core.server's) waits on the first
+        await drain_connections(timeout=2)
+
+        for i, client in enumerate(clients):
+            self.assertEqual(await client.receive_json_from(), {"bye": True, "total": 1})
+            self.assertEqual(await client.receive_close(), 1001)
+            self.assertTrue(await client.receive_nothing())
+            await client.disconnect()
+            self.assertEqual(session_store.get(f"drain-{i}"), {"count": 1})
+
+    async def test_handshakes_are_refused_once_draining(self):
+        await drain_connections(timeout=2)
+        communicator = WebsocketCommunicator(application, "/ws/chat/")
+        await communicator.connect()
+        self.assertEqual(await communicator.receive_close(), OVERLOADED_CLOSE_CODE)
+        await communicator.wait()
@@ -0,0 +1,48 @@
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from chat.connection_pool import _bucket_index, heartbeat_tick, registry
+from chat.tests.websocket import WebsocketCommunicator, application, in_memory_channel_layer
+
+
+@in_memory_channel_layer
+@mock.patch("chat.connection_pool.HEARTBEAT_MAX_MISSED_PONGS", 3)
+class HeartbeatProbeTests(SimpleTestCase):
+
+    async def connect(self, session_id):
+        communicator = WebsocketCommunicator(
+            application, "/ws/chat/?pong=1", headers=[(b"x-session-id", session_id.encode())]
+        )
+        await communicator.connect()
+        await communicator.receive_from()
+        conn, = registry.by_session(session_id)
+        return communicator, conn
+
+    async def test_silent_client_is_closed_after_missed_pongs(self):
+        communicator, conn = await self.connect("pong-silent")
+        for _ in range(3):
+            await heartbeat_tick(_bucket_index(conn))
+            self.assertEqual((await communicator.receive_json_from())["type"], "heartbeat")
+
+        # The fourth heartbeat finds three unanswered ones
+        await heartbeat_tick(_bucket_index(conn))
+        self.assertEqual(await communicator.receive_close(), 1011)
+        self.assertNotIn(conn, registry)
+        await communicator.disconnect()
+
+    async def test_answering_client_is_pinged_every_turn(self):
+        communicator, conn = await self.connect("pong-echo")
+        for _ in range(3):
+            # Its pongs are recent activity, but must not skip it on the next turn
+            await heartbeat_tick(_bucket_index(conn))
+            heartbeat = await communicator.receive_json_from()
+            await communicator.send_json_to({"pong": heartbeat["id"]})
+            await asyncio.sleep(0.01)
+            self.assertIsNone(conn.probe.heartbeat_id)
+
+        self.assertEqual(conn.probe.missed, 0)
+        self.assertIsNotNone(conn.probe.rtt)
+        self.assertIn(conn, registry)
+        await communicator.disconnect()
@@ -0,0 +1,20 @@
+from django.test import SimpleTestCase
+
+
+class MetricsViewTests(SimpleTestCase):
+
+    def test_gzip_follows_accept_encoding_qvalues(self):
+        for accept_encoding, gzipped in [
+            ("gzip", True),
+            ("deflate, gzip;q=0.5", True),
+            ("br, *;q=0.1", True),
+            ("gzip;q=0", False),
+            ("gzip;q=0, *", False),
+            ("*;q=0", False),
+            ("x-gzip-foo", False),
+            ("", False),
+        ]:
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.client.get("/metrics/", HTTP_ACCEPT_ENCODING=accept_encoding)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get("Content-Encoding") == "gzip", gzipped)
@@ -0,0 +1,125 @@
+import asyncio
+from functools import partial
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from chat.connection_pool import registry
+from chat.consumers import session_store
+from chat.outbound import SLOW_CONSUMER_CLOSE_CODE, OutboundBuffer, SlowConsumer
+from chat.tests.websocket import WebsocketCommunicator, application, in_memory_channel_layer
+
+
+@in_memory_channel_layer
+class BatchingConsumerTests(SimpleTestCase):
+
+    async def test_replies_are_array_framed(self):
+        communicator = WebsocketCommunicator(application, "/ws/chat/?batch=1")
+        await communicator.connect()
+        # The session frame is never batched
+        self.assertEqual((await communicator.receive_json_from())["count"], 0)
+
+        for _ in range(3):
+            await communicator.send_to(text_data="m")
+        replies = []
+        while len(replies) < 3:
+            batch = await communicator.receive_json_from()
+            self.assertIsInstance(batch, list)
+            replies.extend(batch)
+        self.assertEqual(replies, [{"count": 1}, {"count": 2}, {"count": 3}])
+        await communicator.disconnect()
+
+
+class OutboundBufferTests(SimpleTestCase):
+
+    def make_buffer(self, **kwargs):
+        self.gate = asyncio.Event()
+        self.written = []
+        self.stalls = []
+
+        async def write_frame(frame):
+            await self.gate.wait()
+            self.written.append(frame)
+
+        return OutboundBuffer(write_frame, self.stalls.append, **kwargs)
+
+    async def test_frames_are_written_in_order(self):
+        buffer = self.make_buffer()
+        self.gate.set()
+        done = []
+        await buffer.write(b"a")
+        await buffer.write(b"b")
+        buffer.on_written(lambda: done.append(True))
+        await buffer.written()
+        self.assertEqual(self.written, [b"a", b"b"])
+        self.assertEqual(done, [True])
+        self.assertEqual(buffer.buffered, 0)
+
+    async def test_pauses_at_high_and_resumes_at_low_watermark(self):
+        buffer = self.make_buffer(high_watermark=10, low_watermark=4, stall_timeout=5)
+        await buffer.write(b"x" * 6)
+        await buffer.write(b"x" * 6)
+        self.assertEqual(buffer.buffered, 12)
+
+        paused = asyncio.ensure_future(buffer.write(b"y"))
+        await asyncio.sleep(0.01)
+        self.assertFalse(paused.done())
+
+        self.gate.set()
+        await asyncio.wait_for(paused, 1)
+        await buffer.written()
+        self.assertEqual(self.written, [b"x" * 6, b"x" * 6, b"y"])
+        self.assertEqual(self.stalls, [])
+
+    async def test_stall_evicts(self):
+        buffer = self.make_buffer(high_watermark=10, low_watermark=4, stall_timeout=0.05)
+        await buffer.write(b"x" * 20)
+        with self.assertRaises(SlowConsumer):
+            await asyncio.wait_for(buffer.write(b"y"), 1)
+        self.assertEqual(len(self.stalls), 1)
+        self.assertTrue(buffer.stalled)
+        self.assertEqual(buffer.buffered, 0)
+
+    async def test_written_times_out_for_a_stuck_socket(self):
+        buffer = self.make_buffer()
+        await buffer.write(b"x")
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(buffer.written(), 0.05)
+        buffer.release()
+
+
+@in_memory_channel_layer
+class SlowConsumerTests(SimpleTestCase):
+
+    def stalling_application(self):
+        """The app, behind a client that stops reading frames once ``self.stalled`` is set"""
+        self.stalled = False
+
+        async def stalling(scope, receive, send):
+            async def stalling_send(message):
+                if self.stalled and message["type"] == "websocket.send":
+                    await asyncio.Event().wait()
+                await send(message)
+            await application(scope, receive, stalling_send)
+        return stalling
+
+    @mock.patch("chat.consumers.OutboundBuffer", partial(
+        OutboundBuffer, high_watermark=64, low_watermark=16, stall_timeout=0.1
+    ))
+    async def test_client_that_stops_reading_is_evicted(self):
+        communicator = WebsocketCommunicator(
+            self.stalling_application(), "/ws/chat/", headers=[(b"x-session-id", b"slow-reader")]
+        )
+        await communicator.connect()
+        await communicator.receive_from()
+        self.stalled = True
+
+        with self.assertLogs(level="WARNING") as logs:
+            for _ in range(20):
+                await communicator.send_to(text_data="m")
+            self.assertEqual(await communicator.receive_close(timeout=2), SLOW_CONSUMER_CLOSE_CODE)
+        self.assertEqual(logs.records[0].getMessage(), "Evicting slow consumer")
+        self.assertEqual(registry.by_session("slow-reader"), [])
+        # Saved on eviction, so the client can resume
+        self.assertGreater(session_store.get("slow-reader")["count"], 0)
+        await communicator.disconnect()
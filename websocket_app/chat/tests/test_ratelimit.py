@@ -0,0 +1,75 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from chat.ratelimit import RATE_LIMIT_CLOSE_CODE, RATE_LIMITED, TokenBucketLimiter
+from chat.tests.websocket import WebsocketCommunicator, application, in_memory_channel_layer
+
+
+class TokenBucketLimiterTests(SimpleTestCase):
+
+    def test_burst_then_refill(self):
+        limiter = TokenBucketLimiter(rate=2, burst=3)
+        self.assertEqual([limiter.allow("k", now=0) for _ in range(4)], [True, True, True, False])
+        self.assertFalse(limiter.allow("k", now=0.25))
+        self.assertTrue(limiter.allow("k", now=0.5))
+        self.assertFalse(limiter.allow("k", now=0.5))
+
+    def test_refill_is_capped_at_burst(self):
+        limiter = TokenBucketLimiter(rate=10, burst=2, max_keys=10)
+        limiter.allow("k", now=0)
+        limiter.allow("other", now=0.1)
+        results = [limiter.allow("k", now=0.15) for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+    def test_full_buckets_are_evicted(self):
+        limiter = TokenBucketLimiter(rate=1, burst=2)
+        limiter.allow("a", now=0)
+        limiter.allow("b", now=1)
+        self.assertEqual(len(limiter), 2)
+        # "a" has been untouched for burst / rate seconds: full again, so dropped
+        limiter.allow("c", now=2)
+        self.assertEqual(len(limiter), 2)
+        self.assertNotIn("a", limiter._buckets)
+
+    def test_max_keys(self):
+        limiter = TokenBucketLimiter(rate=1, burst=10, max_keys=3)
+        for i in range(5):
+            limiter.allow(f"k{i}", now=0)
+        self.assertEqual(list(limiter._buckets), ["k2", "k3", "k4"])
+
+
+@in_memory_channel_layer
+@mock.patch("chat.ratelimit.ip_limiter", None)
+class RateLimitConsumerTests(SimpleTestCase):
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(application, "/ws/chat/")
+        await communicator.connect()
+        await communicator.receive_from()
+        return communicator
+
+    @mock.patch("chat.consumers.RATE_LIMIT_POLICY", "reject")
+    async def test_one_notice_per_throttle_episode(self):
+        with mock.patch("chat.ratelimit.session_limiter", TokenBucketLimiter(rate=0.001, burst=2)):
+            communicator = await self.connect()
+            for _ in range(5):
+                await communicator.send_to(text_data="m")
+            self.assertEqual(await communicator.receive_json_from(), {"count": 1})
+            self.assertEqual(await communicator.receive_json_from(), {"count": 2})
+            self.assertEqual(await communicator.receive_json_from(), RATE_LIMITED)
+            # The rest of the flood is dropped without an echo per frame
+            self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    @mock.patch("chat.consumers.RATE_LIMIT_POLICY", "close")
+    async def test_close_policy(self):
+        with mock.patch("chat.ratelimit.session_limiter", TokenBucketLimiter(rate=0.001, burst=1)):
+            communicator = await self.connect()
+            with self.assertLogs(level="WARNING") as logs:
+                await communicator.send_to(text_data="m")
+                await communicator.send_to(text_data="m")
+                self.assertEqual(await communicator.receive_json_from(), {"count": 1})
+                self.assertEqual(await communicator.receive_close(), RATE_LIMIT_CLOSE_CODE)
+            self.assertEqual(logs.records[0].getMessage(), "Closing rate-limited client")
+        await communicator.disconnect()
@@ -0,0 +1,69 @@
+from django.test import SimpleTestCase
+
+from chat.registry import ConnectionRegistry
+
+
+class FakeConnection:
+    def __init__(self, session_id, client_ip="10.0.0.1"):
+        self.session_id = session_id
+        self.client_ip = client_ip
+
+
+class ConnectionRegistryTests(SimpleTestCase):
+
+    def test_page_walks_connect_order(self):
+        for age_bucket in (60, 1e-9):  # one bucket, and a bucket per connection
+            registry = ConnectionRegistry(age_bucket=age_bucket)
+            conns = [FakeConnection(f"s{i}") for i in range(5)]
+            ids = [registry.add(conn) for conn in conns]
+
+            page, cursor = registry.page(0, 2)
+            self.assertEqual(page, conns[:2])
+            self.assertEqual(cursor, ids[1])
+            page, cursor = registry.page(cursor, 2)
+            self.assertEqual(page, conns[2:4])
+            page, cursor = registry.page(cursor, 2)
+            self.assertEqual(page, conns[4:])
+            self.assertIsNone(cursor)
+
+    def test_page_skips_discarded_and_exact_fit(self):
+        registry = ConnectionRegistry()
+        conns = [FakeConnection(f"s{i}") for i in range(4)]
+        for conn in conns:
+            registry.add(conn)
+        registry.discard(conns[1])
+        self.assertEqual(registry.page(0, 3), ([conns[0], conns[2], conns[3]], None))
+
+    def test_page_rejects_limit_below_one(self):
+        registry = ConnectionRegistry()
+        registry.add(FakeConnection("s"))
+        for limit in (0, -1):
+            with self.assertRaises(ValueError):
+                registry.page(0, limit)
+
+    def test_session_and_ip_indexes(self):
+        registry = ConnectionRegistry()
+        a, b = FakeConnection("dup", "10.0.0.1"), FakeConnection("dup", "10.0.0.1")
+        c = FakeConnection("other", "10.0.0.2")
+        for conn in (a, b, c):
+            registry.add(conn)
+
+        self.assertEqual(registry.by_session("dup"), [a, b])
+        self.assertEqual(registry.by_ip("10.0.0.1"), [a, b])
+        self.assertEqual(registry.by_ip("10.0.0.2"), [c])
+        self.assertEqual(registry.counts(), {"connections": 3, "sessions": 2, "client_ips": 2})
+
+        registry.discard(a)
+        registry.discard(a)
+        self.assertEqual(registry.by_session("dup"), [b])
+        registry.discard(b)
+        self.assertEqual(registry.by_session("dup"), [])
+        self.assertEqual(registry.counts(), {"connections": 1, "sessions": 1, "client_ips": 1})
+        self.assertNotIn(a, registry)
+        self.assertIsNone(registry.connection_id(a))
+
+    def test_add_is_idempotent(self):
+        registry = ConnectionRegistry()
+        conn = FakeConnection("s")
+        self.assertEqual(registry.add(conn), registry.add(conn))
+        self.assertEqual(len(registry), 1)
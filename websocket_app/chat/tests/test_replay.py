@@ -0,0 +1,91 @@
+from django.test import SimpleTestCase
+
+from chat.codecs import JSON_CODEC, encode_for_all
+from chat.replay import ReplayStore
+from chat.tests.websocket import WebsocketCommunicator, application, in_memory_channel_layer
+
+
+class ReplayStoreTests(SimpleTestCase):
+
+    def append(self, store, session_id, seq, count=0):
+        store.append(session_id, JSON_CODEC, seq, JSON_CODEC.add_seq(JSON_CODEC.count_frame(count), seq))
+
+    def test_frames_per_session_are_capped(self):
+        store = ReplayStore(max_frames=3, max_bytes=1 << 20)
+        for seq in range(1, 6):
+            self.append(store, "s", seq, count=seq)
+        self.assertEqual(store.since("s", 0), ['{"seq":3,"count":3}', '{"seq":4,"count":4}', '{"seq":5,"count":5}'])
+        self.assertEqual(store.since("s", 4), ['{"seq":5,"count":5}'])
+        self.assertEqual(store.bytes, sum(len(frame) for frame in store.since("s", 0)))
+
+    def test_byte_cap_drops_least_recently_written(self):
+        frame_size = len(JSON_CODEC.add_seq(JSON_CODEC.count_frame(0), 1))
+        store = ReplayStore(max_frames=10, max_bytes=frame_size * 2)
+        self.append(store, "a", 1)
+        self.append(store, "b", 1)
+        self.append(store, "c", 1)
+        self.assertEqual(list(store.rings), ["b", "c"])
+        self.assertEqual(store.since("a", 0), [])
+
+    def test_attach_with_other_codec_drops_ring(self):
+        store = ReplayStore()
+        self.append(store, "s", 1)
+        other = object()
+        self.assertEqual(store.attach("s", other), 1)
+        self.assertNotIn("s", store.rings)
+        self.assertEqual(store.bytes, 0)
+
+    def test_broadcasts_are_logged_once_and_seqd_on_resume(self):
+        store = ReplayStore()
+        self.append(store, "a", 1)
+        store.detach("a", JSON_CODEC, 1)
+        store.detach("b", JSON_CODEC, 4)
+        store.record_broadcast(encode_for_all({"broadcast": "x"}))
+        store.record_broadcast(encode_for_all({"broadcast": "y"}))
+        self.assertEqual(len(store.log), 2)
+
+        self.assertEqual(store.attach("a", JSON_CODEC), 3)
+        self.assertEqual(store.since("a", 1), ['{"seq":2,"broadcast":"x"}', '{"seq":3,"broadcast":"y"}'])
+        self.assertEqual(store.attach("b", JSON_CODEC), 6)
+        self.assertEqual(store.since("b", 4), ['{"seq":5,"broadcast":"x"}', '{"seq":6,"broadcast":"y"}'])
+
+        # Nobody is detached any more, so the log is not needed
+        store.expire()
+        self.assertEqual(len(store.log), 0)
+        store.record_broadcast(encode_for_all({"broadcast": "z"}))
+        self.assertEqual(len(store.log), 0)
+
+    def test_broadcasts_past_the_log_leave_a_seq_gap(self):
+        store = ReplayStore(max_frames=2)
+        store.detach("s", JSON_CODEC, 0)
+        for i in range(3):
+            store.record_broadcast(encode_for_all({"broadcast": i}))
+        self.assertEqual(store.attach("s", JSON_CODEC), 3)
+        self.assertEqual(store.since("s", 0), ['{"seq":2,"broadcast":1}', '{"seq":3,"broadcast":2}'])
+
+
+@in_memory_channel_layer
+class ReplayConsumerTests(SimpleTestCase):
+
+    async def test_resume_replays_missed_frames(self):
+        headers = [(b"x-session-id", b"replay-resume")]
+        first = WebsocketCommunicator(application, "/ws/chat/?replay=1", headers=headers)
+        await first.connect()
+        await first.receive_from()
+        for count in range(1, 4):
+            await first.send_to(text_data="m")
+            self.assertEqual(await first.receive_json_from(), {"seq": count, "count": count})
+        await first.disconnect()
+
+        # The client only processed seq 1 before the connection dropped
+        second = WebsocketCommunicator(application, "/ws/chat/?replay=1&last_seq=1", headers=headers)
+        await second.connect()
+        self.assertEqual(
+            await second.receive_json_from(),
+            {"session_id": "replay-resume", "resumed": True, "count": 3}
+        )
+        self.assertEqual(await second.receive_json_from(), {"seq": 2, "count": 2})
+        self.assertEqual(await second.receive_json_from(), {"seq": 3, "count": 3})
+        await second.send_to(text_data="m")
+        self.assertEqual(await second.receive_json_from(), {"seq": 4, "count": 4})
+        await second.disconnect()
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from chat.session_store import SQLiteSessionStore, TTLSessionStore
+
+
+class TTLSessionStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch("chat.session_store.time.monotonic", return_value=1000.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_after_ttl(self):
+        store = TTLSessionStore(ttl_seconds=10)
+        store.set("s", {"count": 1})
+        self.clock.return_value = 1010.0
+        self.assertEqual(store.get("s"), {"count": 1})
+        self.clock.return_value = 1010.5
+        self.assertIsNone(store.get("s"))
+        self.assertNotIn("s", store.sessions)
+
+    def test_expired_entries_pruned_on_write(self):
+        store = TTLSessionStore(ttl_seconds=10)
+        store.set("old", {"count": 1})
+        self.clock.return_value = 1005.0
+        store.set("newer", {"count": 2})
+        self.clock.return_value = 1012.0
+        store.set("new", {"count": 3})
+        self.assertEqual(list(store.sessions), ["newer", "new"])
+
+    def test_capacity_evicts_least_recently_saved(self):
+        store = TTLSessionStore(ttl_seconds=10, max_entries=2)
+        store.set("a", {"count": 1})
+        store.set("b", {"count": 1})
+        store.set("a", {"count": 2})  # saved again, now the newest
+        store.set("c", {"count": 1})
+        self.assertEqual(list(store.sessions), ["a", "c"])
+        self.assertEqual(store.get("a"), {"count": 2})
+
+    def test_delete(self):
+        store = TTLSessionStore()
+        store.set("s", {"count": 1})
+        store.delete("s")
+        store.delete("missing")
+        self.assertIsNone(store.get("s"))
+
+
+class SQLiteSessionStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "sessions.sqlite3")
+
+    def open_store(self, **kwargs):
+        # Flushes only when the tests ask for one
+        store = SQLiteSessionStore(self.path, flush_interval=3600, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_writes_are_deferred_until_flush(self):
+        writer, reader = self.open_store(), self.open_store()
+        writer.set("s", {"count": 3})
+        self.assertEqual(writer.get("s"), {"count": 3})
+        self.assertIsNone(reader.get("s"))
+
+        writer.flush()
+        reader._cache.clear()
+        self.assertEqual(reader.get("s"), {"count": 3})
+
+    def test_batch_size_wakes_the_flusher(self):
+        store = self.open_store(batch_size=2)
+        store.set("a", {"count": 1})
+        store.set("b", {"count": 1})
+        deadline = time.monotonic() + 2
+        while store._pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(store._pending, {})
+
+    def test_read_through_fills_the_cache(self):
+        writer, reader = self.open_store(), self.open_store()
+        writer.set("s", {"count": 1})
+        writer.flush()
+        self.assertEqual(asyncio.run(reader.aget("s")), {"count": 1})
+        self.assertIn("s", reader._cache)
+
+    def test_aget_prefers_newer_save_from_another_worker(self):
+        a, b = self.open_store(), self.open_store()
+        a.set("s", {"count": 5})
+        a.flush()
+        self.assertEqual(asyncio.run(b.aget("s")), {"count": 5})
+        b.set("s", {"count": 15})
+        b.flush()
+        self.assertEqual(asyncio.run(a.aget("s")), {"count": 15})
+
+    def test_delete(self):
+        store = self.open_store()
+        store.set("s", {"count": 1})
+        store.flush()
+        store.delete("s")
+        self.assertIsNone(store.get("s"))
+        store.flush()
+        store._cache.clear()
+        self.assertIsNone(store.get("s"))
+
+    @mock.patch("chat.session_store.inc_session_store_evictions")
+    @mock.patch("chat.session_store.set_session_store_entries")
+    def test_cache_gauge_follows_removals(self, entries, evictions):
+        store = self.open_store(cache_ttl=0)
+        store.set("a", {"count": 1})
+        store.set("b", {"count": 1})
+        store.flush()
+        self.assertEqual(entries.call_args.args, (2,))
+
+        store.delete("a")
+        self.assertEqual(entries.call_args.args, (1,))
+        time.sleep(0.01)
+        store.get("b")  # past cache_ttl: dropped from the LRU, then read back through
+        entries.assert_any_call(0)
+        evictions.assert_called_once_with("expired")
@@ -0,0 +1,80 @@
+"""
+In-process WebSocket client for consumer tests.
+
+channels.testing.WebsocketCommunicator cannot be imported here: channels.testing
+pulls in daphne for its live server test case, and this project runs on uvicorn.
+WebsocketCommunicator below keeps the same API on top of asgiref's
+ApplicationCommunicator, so tests read the same as channels' own.
+"""
+import json
+from urllib.parse import unquote, urlparse
+
+from asgiref.testing import ApplicationCommunicator
+from channels.routing import URLRouter
+from django.test import override_settings
+
+from chat.admission import AdmissionMiddleware
+from chat.routing import websocket_urlpatterns
+
+# What core.asgi serves for "websocket", without the background tasks it starts on import
+application = AdmissionMiddleware(URLRouter(websocket_urlpatterns))
+
+# Groups stay in the test process instead of going through CHANNEL_LAYER_DIR
+in_memory_channel_layer = override_settings(CHANNEL_LAYERS={
+    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+})
+
+
+class WebsocketCommunicator(ApplicationCommunicator):
+    """Drives ``application`` through one WebSocket connection to ``path``"""
+
+    def __init__(self, application, path, headers=None, subprotocols=None, client=("127.0.0.1", 50000)):
+        parsed = urlparse(path)
+        self.scope = {
+            "type": "websocket",
+            "path": unquote(parsed.path),
+            "query_string": parsed.query.encode(),
+            "headers": headers or [],
+            "subprotocols": subprotocols or [],
+            "client": client,
+        }
+        super().__init__(application, self.scope)
+
+    async def connect(self, timeout=1):
+        """``(True, subprotocol)`` once accepted, ``(False, close code)`` if refused"""
+        await self.send_input({"type": "websocket.connect"})
+        response = await self.receive_output(timeout)
+        if response["type"] == "websocket.close":
+            return False, response.get("code", 1000)
+        return True, response.get("subprotocol")
+
+    async def send_to(self, text_data=None, bytes_data=None):
+        if text_data is not None:
+            await self.send_input({"type": "websocket.receive", "text": text_data})
+        else:
+            await self.send_input({"type": "websocket.receive", "bytes": bytes_data})
+
+    async def send_json_to(self, data):
+        await self.send_to(text_data=json.dumps(data))
+
+    async def receive_from(self, timeout=1):
+        """The next frame the server sent, text or bytes"""
+        response = await self.receive_output(timeout)
+        assert response["type"] == "websocket.send", f"expected a frame, got {response}"
+        if response.get("text") is not None:
+            return response["text"]
+        return response["bytes"]
+
+    async def receive_json_from(self, timeout=1):
+        return json.loads(await self.receive_from(timeout))
+
+    async def receive_close(self, timeout=1):
+        """Skip frames until the server closes; returns the close code"""
+        while True:
+            response = await self.receive_output(timeout)
+            if response["type"] == "websocket.close":
+                return response.get("code", 1000)
+
+    async def disconnect(self, code=1000, timeout=1):
+        await self.send_input({"type": "websocket.disconnect", "code": code})
+        await self.wait(timeout)
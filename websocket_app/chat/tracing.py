@@ -0,0 +1,79 @@
+"""
+Sampled per-message latency breakdown.
+
+A sampled inbound frame is timestamped (``perf_counter_ns``, monotonic) when the
+ASGI server hands it to the consumer, then again when ``receive()`` starts, when
+the handler has produced its reply and when uvicorn has taken the reply frame.
+That splits the message's latency into stages, each in its own histogram:
+
+- ``queue``: ASGI receive to consumer dispatch (time waiting for the loop)
+- ``handler``: our own compute, including the broadcast fan-out
+- ``send``: reply queued until uvicorn has taken the frame
+- ``total``: all of the above
+
+With TRACE_LOG_SPANS=on every sampled message is also logged as a span record.
+"""
+import logging
+import os
+import random
+from time import perf_counter_ns
+from chat.metrics import record_message_stage
+
+logger = logging.getLogger(__name__)
+
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.01'))  # fraction of messages traced; 0 disables
+TRACE_LOG_SPANS = os.getenv('TRACE_LOG_SPANS', 'off') == 'on'
+
+# Key added to sampled ASGI receive events
+RECEIVED_AT = "trace.received_ns"
+
+
+class TracedReceive:
+    """
+    Wraps an ASGI receive callable so sampled frames carry their arrival time.
+    A slotted callable rather than a closure, as every connection keeps one.
+    """
+    __slots__ = ("receive",)
+
+    def __init__(self, receive):
+        self.receive = receive
+
+    async def __call__(self):
+        message = await self.receive()
+        if message["type"] == "websocket.receive" and random.random() < TRACE_SAMPLE_RATE:
+            message[RECEIVED_AT] = perf_counter_ns()
+        return message
+
+
+class MessageTrace:
+    __slots__ = ("session_id", "received_ns", "started_ns", "handled_ns")
+
+    def __init__(self, session_id, received_ns):
+        self.session_id = session_id
+        self.received_ns = received_ns
+        self.started_ns = received_ns
+        self.handled_ns = received_ns
+
+    def start(self):
+        self.started_ns = perf_counter_ns()
+
+    def handled(self):
+        self.handled_ns = perf_counter_ns()
+
+    def sent(self):
+        """The reply was written; record the stages"""
+        sent_ns = perf_counter_ns()
+        stages = (
+            ("queue", self.started_ns - self.received_ns),
+            ("handler", self.handled_ns - self.started_ns),
+            ("send", sent_ns - self.handled_ns),
+            ("total", sent_ns - self.received_ns),
+        )
+        for stage, ns in stages:
+            record_message_stage(stage, ns / 1e9)
+
+        if TRACE_LOG_SPANS:
+            logger.info("Message span", extra={
+                "session_id": self.session_id,
+                **{f"{stage}_ms": round(ns / 1e6, 3) for stage, ns in stages}
+            })
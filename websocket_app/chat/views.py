@@ -1,26 +1,73 @@
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from prometheus_client import CONTENT_TYPE_LATEST
-from chat.metrics import get_metrics_text, legacy_metrics
-from chat.connection_pool import active_connections
+from chat.metrics import render_metrics, get_metric_totals, get_active_connections_total, app_start_time
+from chat.admission import overload_reason
+from chat.loop_monitor import get_loop_stats
+from chat.process_stats import get_process_stats
+from chat.connection_pool import describe_connection, get_connection_stats, registry
+from chat.registry import KICKED_CLOSE_CODE
+import hmac
 import os
 import time
 import json
-from django.core.exceptions import DisallowedHost
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Log one in this many /metrics/ scrapes; 0 disables scrape logging
+METRICS_LOG_EVERY = int(os.getenv('METRICS_LOG_EVERY', '100'))
+_scrapes = 0
+
+# Sent as X-Admin-Token to /connections/; the endpoints answer 403 while it is unset
+CONNECTIONS_ADMIN_TOKEN = os.getenv('CONNECTIONS_ADMIN_TOKEN', '')
+CONNECTIONS_PAGE_MAX = 1000
+
+def _accepts_gzip(accept_encoding):
+    """
+    Whether an Accept-Encoding value allows gzip: listed, or covered by ``*``,
+    with a q-value above 0 (RFC 9110 12.5.3)
+    """
+    qvalues = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        qvalue = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[coding.strip().lower()] = qvalue
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qvalues:
+            return qvalues[coding] > 0
+    return False
+
 def metrics_view(request):
-    """Prometheus metrics endpoint"""
-    logger.info(f"Metrics request: method={request.method}, headers={request.headers}, path={request.path}")
-    try:
-        response = get_metrics_text()
-        return HttpResponse(response, content_type=CONTENT_TYPE_LATEST)
-    except DisallowedHost as e:
-        logger.warning(f"DisallowedHost bypassed for metrics: {str(e)}")
-        return HttpResponse(get_metrics_text(), content_type=CONTENT_TYPE_LATEST)
+    """
+    Prometheus metrics endpoint.
+
+    A sync view, so Django runs it on a worker thread rather than the event
+    loop; the body itself comes from the render cache in chat.metrics.
+    """
+    global _scrapes
+    gzipped = _accepts_gzip(request.headers.get('Accept-Encoding', ''))
+    body, content_type = render_metrics(request.headers.get('Accept'), gzipped)
+    response = HttpResponse(body, content_type=content_type)
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    response['Vary'] = 'Accept, Accept-Encoding'
+
+    _scrapes += 1
+    if METRICS_LOG_EVERY and _scrapes % METRICS_LOG_EVERY == 0:
+        logger.info("Metrics scraped", extra={
+            "scrapes": _scrapes,
+            "user_agent": request.headers.get('User-Agent'),
+            "remote_addr": request.headers.get('X-Real-IP', request.META.get('REMOTE_ADDR')),
+        })
+    return response
 
 @csrf_exempt
 @require_http_methods(["GET"])
@@ -36,7 +83,7 @@ def health_check(request):
             "timestamp": int(time.time()),
             "deployment_color": deployment_color,
             "service": "django-websocket-app",
-            "active_connections": len(active_connections),
+            "active_connections": get_active_connections_total(),
             "version": "1.0.0"
         }
         
@@ -58,6 +105,13 @@ def observability_status(request):
     """
     try:
         deployment_color = os.getenv('DEPLOYMENT_COLOR', 'unknown')
+        # Summed over every worker in multi-worker mode
+        totals = get_metric_totals(
+            'websocket_connections_active',
+            'websocket_connections_total',
+            'websocket_messages_total',
+            'websocket_heartbeat_pings_total',
+        )
         
         status_data = {
             "service": "django-websocket-app",
@@ -65,16 +119,18 @@ def observability_status(request):
             "timestamp": int(time.time()),
             "health": "healthy",
             "metrics": {
-                "active_connections": len(active_connections),
-                "total_connections": legacy_metrics.get("total_connections", 0),
-                "total_messages": legacy_metrics.get("total_messages", 0),
-                "heartbeat_pings": legacy_metrics.get("heartbeat_pings", 0)
+                "active_connections": int(totals['websocket_connections_active']),
+                "total_connections": int(totals['websocket_connections_total']),
+                "total_messages": int(totals['websocket_messages_total']),
+                "heartbeat_pings": int(totals['websocket_heartbeat_pings_total'])
             },
+            # Sampled in the background by the worker that served this request
             "system": {
-                "uptime_seconds": int(time.time() - 1721180306),  # Approximate start time
-                "memory_usage": "unknown",  # You can add psutil later if needed
-                "cpu_usage": "unknown"
+                "uptime_seconds": int(time.time() - app_start_time),
+                **get_process_stats()
             },
+            # For the worker that served this request
+            "event_loop": get_loop_stats(),
             "endpoints": {
                 "health": "/health/",
                 "metrics": "/metrics/",
@@ -104,17 +160,24 @@ def readiness_check(request):
         
         # You can add more sophisticated readiness checks here
         # For example: database connectivity, external service availability, etc.
+
+        # Not ready while this worker refuses new WebSocket connections
+        overload = overload_reason()
         
         ready_data = {
-            "ready": True,
+            "ready": overload is None,
             "deployment_color": deployment_color,
             "timestamp": int(time.time()),
             "checks": {
                 "websocket_handler": True,
                 "metrics_collector": True,
-                "session_store": True
+                "session_store": True,
+                "admission": overload is None
             }
         }
+        if overload is not None:
+            ready_data["reason"] = overload
+            return JsonResponse(ready_data, status=503)
         
         return JsonResponse(ready_data, status=200)
     
@@ -123,4 +186,65 @@ def readiness_check(request):
             "ready": False,
             "error": str(e),
             "timestamp": int(time.time())
-        }, status=503)  # Service Unavailable
\ No newline at end of file
+        }, status=503)  # Service Unavailable
+
+
+def _admin_authorized(request):
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(CONNECTIONS_ADMIN_TOKEN) and hmac.compare_digest(token, CONNECTIONS_ADMIN_TOKEN)
+
+
+async def connections_view(request):
+    """
+    This worker's connections, a page at a time (``?after=<next>&limit=``), or
+    every connection of one ``?session_id=`` or ``?client_ip=``.
+
+    Async so it reads the registry on the event loop that owns it. The
+    csrf/method decorators wrap views in sync functions on Django 4.2, hence
+    the checks by hand.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not _admin_authorized(request):
+        return JsonResponse({"error": "forbidden"}, status=403)
+
+    try:
+        after = int(request.GET.get('after', 0))
+        limit = int(request.GET.get('limit', 100))
+    except ValueError:
+        return JsonResponse({"error": "after and limit must be integers"}, status=400)
+    if not 1 <= limit <= CONNECTIONS_PAGE_MAX:
+        return JsonResponse({"error": f"limit must be between 1 and {CONNECTIONS_PAGE_MAX}"}, status=400)
+
+    session_id = request.GET.get('session_id')
+    client_ip = request.GET.get('client_ip')
+    if session_id is not None or client_ip is not None:
+        connections = registry.by_session(session_id) if session_id is not None else registry.by_ip(client_ip)
+        return JsonResponse({
+            "counts": registry.counts(),
+            "connections": [describe_connection(conn) for conn in connections],
+            "next": None,
+        })
+    return JsonResponse(get_connection_stats(after, limit))
+
+
+async def kick_session_view(request):
+    """Close this worker's connections of ``?session_id=``; the session stays resumable"""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if not _admin_authorized(request):
+        return JsonResponse({"error": "forbidden"}, status=403)
+
+    session_id = request.GET.get('session_id')
+    if not session_id:
+        return JsonResponse({"error": "session_id is required"}, status=400)
+
+    connections = registry.by_session(session_id)
+    for conn in connections:
+        conn.kick("admin", KICKED_CLOSE_CODE)
+    logger.info("Kicked session", extra={"session_id": session_id, "connections": len(connections)})
+    return JsonResponse({"session_id": session_id, "kicked": len(connections)})
+
+# Authenticated by X-Admin-Token; there is no cookie session to protect
+connections_view.csrf_exempt = True
+kick_session_view.csrf_exempt = True
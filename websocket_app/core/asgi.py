@@ -7,25 +7,25 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 import logging
-from pythonjsonlogger import jsonlogger
+from core.log_pipeline import configure_logging
 
-logger = logging.getLogger()
-log_handler = logging.StreamHandler()
-
-formatter = jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(message)s')
-log_handler.setFormatter(formatter)
-
-logger.setLevel(logging.INFO)
-logger.addHandler(log_handler)
+# JSON logs, written by a background thread
+configure_logging()
+logger = logging.getLogger(__name__)
 
 import os
 import django
 from channels.routing import ProtocolTypeRouter, URLRouter
 from chat.connection_pool import heartbeat
-from chat.connection_pool import active_connections
-from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
 from chat.routing import websocket_urlpatterns
+from chat.consumers import session_store
+from chat.metrics import mark_worker_dead, start_metrics_flusher
+from chat.admission import AdmissionMiddleware
+from chat.drain import drain_connections
+from chat.loop_monitor import monitor_event_loop
+from chat.process_stats import start_process_sampler
+from chat.replay import record_broadcasts
 from chat.connection_pool import heartbeat
 import asyncio
 
@@ -33,14 +33,19 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 django.setup()
 
 asyncio.get_event_loop().create_task(heartbeat())
+asyncio.get_event_loop().create_task(monitor_event_loop())
+asyncio.get_event_loop().create_task(record_broadcasts())
+start_process_sampler()
+start_metrics_flusher()
 
 routes = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
+    # No AuthMiddlewareStack: sessions are keyed by X-Session-Id, never scope["user"],
+    # and its cookie, session and auth layers each keep a scope copy per connection
+    "websocket": AdmissionMiddleware(URLRouter(websocket_urlpatterns)),
 })
 
 from datetime import datetime
-import json
 
 class LifespanApp:
     def __init__(self, app):
@@ -53,30 +58,12 @@ class LifespanApp:
                 if message["type"] == "lifespan.startup":
                     await send({"type": "lifespan.startup.complete"})
                 elif message["type"] == "lifespan.shutdown":
-                    print("[Shutdown] Closing WebSocket connections...")
-                    print(f"[shutdown] Pool size: {len(active_connections)}")
-                    tasks = []
-
-                    for conn in list(active_connections):
-                        try:
-                            # Wait for in-flight messages
-                            for _ in range(100):
-                                if getattr(conn, "active", 0) == 0:
-                                    break
-                                await asyncio.sleep(0.1)
-
-                            if getattr(conn, "closed", False):
-                                print("Connection already closed. Skipping close.")
-                                continue
-
-                            await conn.send(text_data=json.dumps({
-                                "bye": True,
-                                "total": getattr(conn, "count", 0)
-                            }))
-                            await conn.close(code=1001)
+                    # Usually waits on the drain core.server started before uvicorn dropped connections
+                    await drain_connections()
 
-                        except Exception as e:
-                            print(f"Failed to close conn: {e}")
+                    # Persist any session writes still buffered by the store
+                    await asyncio.to_thread(session_store.close)
+                    mark_worker_dead()
 
                     await send({"type": "lifespan.shutdown.complete"})
                     return
@@ -0,0 +1,58 @@
+"""
+Logging setup that never blocks the event loop on stdout.
+
+Records are handed to a bounded queue by a QueueHandler on the root logger;
+a QueueListener thread formats them as JSON and writes them out. When the
+queue is full (stdout stalled, or a reconnect storm logging faster than the
+pipe drains) records are dropped and counted in log_records_dropped_total
+instead of stalling whoever logged them.
+"""
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from pythonjsonlogger import jsonlogger
+from chat.metrics import inc_log_records_dropped
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # records buffered before dropping
+
+_listener = None
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def prepare(self, record):
+        # Only resolve the message here; JSON formatting happens on the listener thread.
+        # The args may be mutable, so they cannot wait for the other thread.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            inc_log_records_dropped()
+
+
+def configure_logging():
+    """Route the root logger through the queue to a JSON stream handler"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(jsonlogger.JsonFormatter('%(asctime)s %(levelname)s %(message)s'))
+
+    records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(DroppingQueueHandler(records))
+
+    _listener = QueueListener(records, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # Write out whatever is still queued when the process exits
+    atexit.register(_listener.stop)
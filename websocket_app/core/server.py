@@ -0,0 +1,118 @@
+"""
+Uvicorn entry point for the app, with the WebSocket transport settings wired in.
+
+    python -m core.server
+
+Honours HOST, PORT and WEB_CONCURRENCY, plus the permessage-deflate settings below.
+Plain ``uvicorn core.asgi:application`` still works, but then uvicorn's default
+deflate applies, which compresses every frame regardless of size, and open
+WebSockets are dropped with 1012 on shutdown instead of being drained.
+"""
+import os
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CONT, CTRL_OPCODES
+
+from chat.metrics import record_compressed_bytes, record_uncompressed_bytes
+
+# permessage-deflate, negotiated per connection with clients that offer it
+WS_COMPRESSION = os.getenv('WS_COMPRESSION', 'on') == 'on'
+WS_COMPRESSION_THRESHOLD = int(os.getenv('WS_COMPRESSION_THRESHOLD', '512'))  # bytes; smaller messages go out raw
+WS_COMPRESSION_LEVEL = int(os.getenv('WS_COMPRESSION_LEVEL', '6'))  # zlib level, 1 (fast) to 9 (small)
+WS_COMPRESSION_WINDOW_BITS = int(os.getenv('WS_COMPRESSION_WINDOW_BITS', '15'))  # 9-15; lower saves memory per socket
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """permessage-deflate that sends messages under ``threshold`` bytes uncompressed"""
+
+    def __init__(self, *args, threshold=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+        self._skip_message = False
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+
+        # RSV1 is decided per message, so the first frame decides for all of its fragments
+        if frame.opcode is not CONT:
+            self._skip_message = len(frame.data) < self.threshold
+        if self._skip_message:
+            record_uncompressed_bytes(len(frame.data))
+            return frame
+
+        encoded = super().encode(frame)
+        record_compressed_bytes(len(frame.data), len(encoded.data))
+        return encoded
+
+
+class ThresholdPerMessageDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, threshold=0, **kwargs):
+        super().__init__(**kwargs)
+        self.threshold = threshold
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, ThresholdPerMessageDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+            threshold=self.threshold,
+        )
+
+
+class CompressionWebSocketProtocol(WebSocketProtocol):
+    """uvicorn's websockets protocol with our deflate settings instead of the default"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.available_extensions = [
+            ThresholdPerMessageDeflateFactory(
+                threshold=WS_COMPRESSION_THRESHOLD,
+                server_max_window_bits=WS_COMPRESSION_WINDOW_BITS if WS_COMPRESSION_WINDOW_BITS < 15 else None,
+                compress_settings={"level": WS_COMPRESSION_LEVEL},
+            )
+        ] if WS_COMPRESSION else []
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server that drains WebSockets before shutting down.
+
+    uvicorn fails every open WebSocket with 1012 before it even sends the
+    lifespan shutdown event, so the drain has to run here: clients get their
+    bye frame and a 1001 close, and their counts are saved.
+    """
+
+    async def shutdown(self, sockets=None):
+        # Imported here: the app (and its session store) only exists in worker processes
+        from chat.drain import drain_connections
+        await drain_connections()
+        await super().shutdown(sockets=sockets)
+
+
+def main():
+    config = uvicorn.Config(
+        "core.asgi:application",
+        host=os.getenv('HOST', '0.0.0.0'),
+        port=int(os.getenv('PORT', '8000')),
+        workers=int(os.getenv('WEB_CONCURRENCY', '1')),
+        ws=CompressionWebSocketProtocol,
+        ws_per_message_deflate=WS_COMPRESSION,
+    )
+    server = DrainingServer(config)
+    # Same as uvicorn.run(), but with our server class
+    if config.workers > 1:
+        sock = config.bind_socket()
+        Multiprocess(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+
+
+if __name__ == "__main__":
+    main()
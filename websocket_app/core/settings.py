@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -124,3 +125,15 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 ASGI_APPLICATION = "core.asgi.application"
+
+# Cross-process channel layer used for group broadcasts. Every uvicorn worker and
+# both blue/green colors must share CHANNEL_LAYER_DIR for broadcasts to reach them.
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "chat.channel_layer.LocalProcessChannelLayer",
+        "CONFIG": {
+            "socket_dir": os.getenv("CHANNEL_LAYER_DIR", "/tmp/ws-channel-layer"),
+            "capacity": int(os.getenv("CHANNEL_LAYER_CAPACITY", "100")),
+        },
+    },
+}
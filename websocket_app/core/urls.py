@@ -16,7 +16,9 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from chat.views import metrics_view, health_check, observability_status, readiness_check
+from chat.views import (
+    metrics_view, health_check, observability_status, readiness_check, connections_view, kick_session_view
+)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,6 +28,10 @@ urlpatterns = [
     path('health/', health_check, name='health'),             # Health check
     path('ready/', readiness_check, name='readiness'),        # Readiness check
     path('observability/', observability_status, name='observability'),  # Detailed status
+
+    # Connection admin (X-Admin-Token: $CONNECTIONS_ADMIN_TOKEN), per worker
+    path('connections/', connections_view, name='connections'),              # Paginated connection list
+    path('connections/kick/', kick_session_view, name='connections_kick'),   # POST ?session_id=
     
     # Legacy endpoint (keep for backward compatibility)
     # path('metrics', metrics_view, name='metrics_legacy'),     # Without trailing slash
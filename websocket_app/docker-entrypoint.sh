@@ -0,0 +1,14 @@
+#!/bin/sh
+set -e
+
+# Multi-worker mode: uvicorn reads WEB_CONCURRENCY as its --workers default.
+# With more than one worker, Prometheus metrics are collected through files in
+# PROMETHEUS_MULTIPROC_DIR so /metrics/, /health/ and /observability/ report
+# totals across all workers. The directory must start empty on every boot.
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+  export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}"
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+exec "$@"